@@ -1,3 +1,4 @@
+import io
 import os
 from pathlib import Path
 from PIL import Image
@@ -6,92 +7,255 @@ from transformers import CLIPProcessor, CLIPModel
 from tqdm import tqdm
 import chromadb
 import concurrent.futures
-from typing import List, Tuple
+from typing import Callable, Iterator, List, Optional, Tuple
 import numpy as np
+from ingest_manifest import IMAGE_EXTENSIONS, IngestManifest, scan_images
+from index_config import hnsw_metadata, open_collection
+from model_registry import checkpoint_metadata, pin_collection_model
+from packed_store import PackedStore
+from thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_SIZES, generate_thumbnails, remove_thumbnails
 # Check device (XPU if available, else CPU)
 device = torch.device("xpu" if torch.xpu.is_available() else "cpu")
 print(f"Using device: {device}")
 
-def load_and_process_image(image_path: str, processor: CLIPProcessor, model: CLIPModel, device: torch.device) -> Tuple[str, str, List[float]]:
+# Processor (and image store, if any) used by preprocessing workers, set once per worker by _init_worker
+_worker_processor: Optional[CLIPProcessor] = None
+_worker_store: Optional[PackedStore] = None
+
+def _init_worker(processor: CLIPProcessor, store_root: Optional[str] = None):
+    """Give each preprocessing worker its own processor and a single torch thread"""
+    global _worker_processor, _worker_store
+    # Workers only decode and resize; leave the intra-op threads to the encoder
+    torch.set_num_threads(1)
+    _worker_processor = processor
+    _worker_store = PackedStore(store_root, readonly=True) if store_root else None
+
+def preprocess_image(image_path: str) -> Optional[Tuple[str, str, np.ndarray]]:
+    """Decode an image and turn it into CLIP pixel values (runs in a worker)
+
+    image_path is a key of the worker's image store when ingesting from a PackedStore.
+    """
     file_name = Path(image_path).stem
     character_name = file_name.replace('_', ' ')
 
     try:
-        # Load and preprocess image
-        image = Image.open(image_path).convert('RGB')
-        inputs = processor(images=image, return_tensors="pt")
-        
-        # Move tensors to device
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-
-        # Generate embedding
-        with torch.no_grad():
-            image_features = model.get_image_features(**inputs)
-
-        # Move back to CPU for normalization and storage
-        embedding = image_features[0].cpu().numpy()
-        normalized_embedding = embedding / np.linalg.norm(embedding)
-
-        return character_name, file_name, normalized_embedding.tolist()
+        source = io.BytesIO(_worker_store.get(image_path)) if _worker_store is not None else image_path
+        image = Image.open(source).convert('RGB')
+        pixel_values = _worker_processor(images=image, return_tensors="np")["pixel_values"][0]
+        return character_name, file_name, pixel_values
     except Exception as e:
         print(f"Error processing {image_path}: {str(e)}")
         return None
 
-def main():
-    model_name = "cyborgpunk/anime_2"
-    processor = CLIPProcessor.from_pretrained(model_name, use_fast=True)
-    model = CLIPModel.from_pretrained(model_name)
+def preprocess_bytes(item: Tuple[str, bytes]) -> Optional[Tuple[str, str, np.ndarray]]:
+    """Same as preprocess_image for (file name, image bytes) that never touched the disk"""
+    file_name = Path(item[0]).stem
+    try:
+        image = Image.open(io.BytesIO(item[1])).convert('RGB')
+        pixel_values = _worker_processor(images=image, return_tensors="np")["pixel_values"][0]
+        return file_name.replace('_', ' '), file_name, pixel_values
+    except Exception as e:
+        print(f"Error processing {item[0]}: {str(e)}")
+        return None
+
+def embed_batch(pixel_values: np.ndarray, model: CLIPModel, device: torch.device) -> np.ndarray:
+    """Run one forward pass over a stacked batch and return normalized embeddings"""
+    inputs = torch.from_numpy(pixel_values).to(device)
 
-    # Move model to device (XPU/CPU)
-    model.to(device)
-    model.eval()
+    with torch.no_grad():
+        image_features = model.get_image_features(pixel_values=inputs)
 
+    # Move back to CPU for normalization and storage
+    embeddings = image_features.cpu().numpy()
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+def upsert_batch(batch_data: List[Tuple[str, str, np.ndarray]], collection, model: CLIPModel, device: torch.device) -> List[str]:
+    """Embed one preprocessed batch and upsert it; returns the ids written"""
+    character_names, file_ids, pixel_values = zip(*batch_data)
+    embeddings = embed_batch(np.stack(pixel_values), model, device)
+    collection.upsert(
+        documents=list(character_names),
+        ids=list(file_ids),
+        embeddings=embeddings.tolist()
+    )
+    return list(file_ids)
+
+def iter_preprocessed_batches(image_files: List[str],
+                              batch_size: int,
+                              executor: Optional[concurrent.futures.Executor]) -> Iterator[List[Tuple[str, str, np.ndarray]]]:
+    """Yield preprocessed batches, keeping the next batch in flight while the current one is encoded"""
+    pending = None
+    for i in range(0, len(image_files), batch_size):
+        batch_files = image_files[i:i + batch_size]
+        if executor is None:
+            batch = map(preprocess_image, batch_files)
+        else:
+            # Executor.map submits the whole batch right away
+            batch = executor.map(preprocess_image, batch_files, chunksize=max(1, batch_size // 8))
+        if pending is not None:
+            yield [result for result in pending if result is not None]
+        pending = batch
+    if pending is not None:
+        yield [result for result in pending if result is not None]
+
+def ingest(image_files: List[str],
+           collection,
+           model: CLIPModel,
+           processor: CLIPProcessor,
+           device: torch.device,
+           batch_size: int = 32,
+           num_workers: Optional[int] = None,
+           on_commit: Optional[Callable[[List[str]], None]] = None,
+           image_store: Optional[str] = None) -> int:
+    """Embed image files in batches and upsert them into the collection; returns the number stored
+
+    on_commit is called with the ids of every batch right after it has been written.
+    With image_store (a PackedStore directory) image_files are keys in that store.
+    """
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 2) - 1)
+
+    processed_count = 0
+    num_batches = (len(image_files) + batch_size - 1) // batch_size
+
+    # Decode/preprocess in worker processes so they don't compete with the encoder for the GIL
+    executor = None
+    if num_workers > 0:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_init_worker,
+            initargs=(processor, image_store)
+        )
+    else:
+        global _worker_processor, _worker_store
+        _worker_processor = processor
+        _worker_store = PackedStore(image_store, readonly=True) if image_store else None
+
+    try:
+        batches = iter_preprocessed_batches(image_files, batch_size, executor)
+        for batch_data in tqdm(batches, total=num_batches, desc="Processing batches"):
+            if not batch_data:
+                continue
+
+            try:
+                file_ids = upsert_batch(batch_data, collection, model, device)
+                processed_count += len(batch_data)
+                if on_commit is not None:
+                    on_commit(file_ids)
+            except Exception as e:
+                print(f"Error adding batch to ChromaDB: {str(e)}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return processed_count
+
+def main(model_name: str = "cyborgpunk/anime_2",
+         image_dir: str = "./images",
+         chroma_path: str = "./chroma_db",
+         batch_size: int = 32,
+         num_workers: Optional[int] = None,
+         full: bool = False,
+         index_metadata: Optional[dict] = None,
+         thumbnails_dir: Optional[str] = "./thumbnails",
+         thumbnail_sizes: Tuple[int, ...] = THUMBNAIL_SIZES,
+         thumbnail_formats: Tuple[str, ...] = THUMBNAIL_FORMATS,
+         image_store: Optional[str] = None,
+         thumbnail_store: Optional[str] = None):
+    """Embed new or changed images, drop vanished ones; full=True re-embeds everything
+
+    index_metadata (see index_config.hnsw_metadata) only applies when the collection is created.
+    Thumbnails for the served API are brought up to date alongside; thumbnails_dir=None skips them.
+    The default sizes and formats are the THUMBNAIL_SIZES/THUMBNAIL_FORMATS the apps serve.
+    image_store/thumbnail_store are PackedStore directories used instead of image_dir/thumbnails_dir.
+    """
     # Initialize ChromaDB
-    chroma_client = chromadb.PersistentClient(path="./chroma_db")
-    collection = chroma_client.get_or_create_collection(
-        name="anime_clip_embeddings"
+    chroma_client = chromadb.PersistentClient(path=chroma_path)
+    collection = open_collection(
+        chroma_client, "anime_clip_embeddings", index_metadata or hnsw_metadata()
     )
+    processor = CLIPProcessor.from_pretrained(model_name, use_fast=True)
+    # Refuses to mix models in one collection, and records the model on collections that lack it
+    pin_collection_model(collection, checkpoint_metadata(model_name, processor))
+
+    # The manifest lives next to the collection it describes
+    manifest = IngestManifest(os.path.join(chroma_path, "ingest_manifest.sqlite3"))
+    images = PackedStore(image_store, readonly=True) if image_store else None
+    thumbnails = PackedStore(thumbnail_store) if thumbnail_store else None
+    plan = manifest.plan(image_dir, model_name, force=full, image_store=images)
+    print(f"Unchanged: {plan.unchanged}, to embed: {len(plan.to_embed)}, "
+          f"moved/touched: {len(plan.touched)}, removed: {len(plan.removed)}")
 
-    # Get list of image files
-    image_dir = "./images"
-    image_files = [
-        os.path.join(image_dir, f) for f in os.listdir(image_dir)
-        if f.lower().endswith(('.png', '.jpg', '.jpeg'))
-    ]
+    if plan.removed:
+        collection.delete(ids=plan.removed)
+        manifest.remove(plan.removed)
+        if thumbnails_dir or thumbnails is not None:
+            remove_thumbnails(plan.removed, thumbnails_dir, thumbnail_sizes, thumbnail_formats, thumbnails)
+    if plan.touched:
+        manifest.record(plan.touched)
 
     processed_count = 0
-    batch_size = 32  # Adjust as needed
-
-    # Use ThreadPoolExecutor for I/O bound tasks, but consider ProcessPoolExecutor for CPU-bound preprocessing if needed
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        for i in tqdm(range(0, len(image_files), batch_size), desc="Processing batches"):
-            batch_files = image_files[i:i + batch_size]
-
-            futures = [
-                executor.submit(load_and_process_image, img_path, processor, model, device)
-                for img_path in batch_files
-            ]
-
-            batch_data = []
-            for future in concurrent.futures.as_completed(futures):
-                result = future.result()
-                if result is not None:
-                    batch_data.append(result)
-
-            if batch_data:
-                character_names, file_ids, embeddings = zip(*batch_data)
-                try:
-                    collection.add(
-                        documents=list(character_names),
-                        ids=list(file_ids),
-                        embeddings=list(embeddings)
-                    )
-                    processed_count += len(batch_data)
-                except Exception as e:
-                    print(f"Error adding batch to ChromaDB: {str(e)}")
+    if plan.to_embed:
+        model = CLIPModel.from_pretrained(model_name)
+
+        # Move model to device (XPU/CPU)
+        model.to(device)
+        model.eval()
+
+        pending = {entry.id: entry for entry in plan.to_embed}
+        # Each batch is recorded only after its upsert, so a rerun resumes after the last committed batch
+        processed_count = ingest(
+            [entry.path for entry in plan.to_embed], collection, model, processor, device,
+            batch_size=batch_size, num_workers=num_workers,
+            on_commit=lambda ids: manifest.record(pending[i] for i in ids),
+            image_store=image_store
+        )
+    manifest.close()
+
+    if thumbnails_dir or thumbnails is not None:
+        # Every current image, not just re-embedded ones: up-to-date thumbnails are skipped cheaply
+        if images is not None:
+            sources = [key for key in images.keys() if key.lower().endswith(IMAGE_EXTENSIONS)]
+        else:
+            sources = [path for _, path, _, _ in scan_images(image_dir)]
+        written = generate_thumbnails(sources, thumbnails_dir, thumbnail_sizes, thumbnail_formats,
+                                      num_workers=num_workers, force=full,
+                                      image_store=images, thumbnail_store=thumbnails)
+        print(f"Thumbnails written: {written}")
+    for store in (images, thumbnails):
+        if store is not None:
+            store.close()
 
     print(f"\nProcessing complete! Total images processed: {processed_count}")
     print(f"Collection count: {collection.count()}")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Embed character images into ChromaDB")
+    parser.add_argument("--model", default="cyborgpunk/anime_2")
+    parser.add_argument("--images", default="./images")
+    parser.add_argument("--chroma-path", default="./chroma_db")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-embed every image")
+    parser.add_argument("--space", choices=["l2", "cosine", "ip"], default="cosine")
+    parser.add_argument("--hnsw-m", type=int, default=16)
+    parser.add_argument("--construction-ef", type=int, default=100)
+    parser.add_argument("--search-ef", type=int, default=10)
+    parser.add_argument("--thumbnails", default="./thumbnails", help="Thumbnail directory served by app.py")
+    parser.add_argument("--no-thumbnails", action="store_true")
+    parser.add_argument("--thumbnail-sizes", nargs="+", type=int, default=list(THUMBNAIL_SIZES),
+                        help="Defaults to THUMBNAIL_SIZES, which the apps link results to")
+    parser.add_argument("--thumbnail-formats", nargs="+", choices=["jpeg", "webp", "png"], default=list(THUMBNAIL_FORMATS),
+                        help="Defaults to THUMBNAIL_FORMATS, which the apps link results to")
+    parser.add_argument("--image-store", default=None, help="Read images from a PackedStore instead of --images")
+    parser.add_argument("--thumbnail-store", default=None, help="Write thumbnails to a PackedStore instead of --thumbnails")
+    args = parser.parse_args()
+
+    main(model_name=args.model, image_dir=args.images, chroma_path=args.chroma_path,
+         batch_size=args.batch_size, num_workers=args.workers, full=args.full,
+         index_metadata=hnsw_metadata(args.space, args.hnsw_m, args.construction_ef, args.search_ef),
+         thumbnails_dir=None if args.no_thumbnails else args.thumbnails,
+         thumbnail_sizes=tuple(args.thumbnail_sizes), thumbnail_formats=tuple(args.thumbnail_formats),
+         image_store=args.image_store, thumbnail_store=args.thumbnail_store)
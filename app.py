@@ -2,17 +2,68 @@ import requests
 import os
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from flask import Flask, request, jsonify, send_from_directory
+import json
+import mimetypes
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_cors import CORS
-from PIL import Image 
-import io
 from semantic_search import AnimeImageSearch
+from batching import MicroBatcher
+from cascade import CascadeSearch
+from model_registry import ModelRegistry
+from metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, current_endpoint, timed_stage
+from packed_store import PackedStore
+from thumbnails import generate_thumbnail, parse_thumbnail_name, thumbnail_variants
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Initialize the search engine
-searcher = AnimeImageSearch()
+def load_indexes(config_path):
+    """Searchers for every index named in a JSON file, the default (first) one first
+
+    Each entry is either AnimeImageSearch arguments, e.g.
+    {"large": {"chroma_path": "./chroma_last"}, "anime2": {"chroma_path": "./chroma_db"}},
+    or {"cascade": {"coarse": "anime2", "fine": "large", "candidates": 200}} over two of them.
+    Indexes built with the same model share one loaded copy of it, and all share one Jikan client.
+    """
+    with open(config_path) as f:
+        config = json.load(f)
+    registry = ModelRegistry()
+    loaded = {}
+    jikan = None
+    for name, options in config.items():
+        if 'cascade' not in options:
+            loaded[name] = AnimeImageSearch(**options, registry=registry, jikan_client=jikan)
+            jikan = loaded[name].jikan
+    for name, options in config.items():
+        if 'cascade' in options:
+            cascade = options['cascade']
+            loaded[name] = CascadeSearch(loaded[cascade['coarse']], loaded[cascade['fine']],
+                                         candidates=cascade.get('candidates', 200))
+    return {name: loaded[name] for name in config}
+
+# Initialize the search engine. SEARCH_INDEXES names a JSON file of several indexes to serve
+# side by side (see load_indexes); requests pick one with an "index" field. With SEARCH_SNAPSHOT
+# pointing at a directory written by `vector_backend.py export`, the single index is served
+# read-only from the snapshot and Chroma is never opened
+SEARCH_INDEXES = os.environ.get("SEARCH_INDEXES")
+SEARCH_SNAPSHOT = os.environ.get("SEARCH_SNAPSHOT")
+if SEARCH_INDEXES:
+    searchers = load_indexes(SEARCH_INDEXES)
+elif SEARCH_SNAPSHOT:
+    searchers = {'default': AnimeImageSearch(chroma_path=None, snapshot_dir=SEARCH_SNAPSHOT)}
+else:
+    searchers = {'default': AnimeImageSearch()}
+DEFAULT_INDEX = next(iter(searchers))
+searcher = searchers[DEFAULT_INDEX]
+
+# Concurrent single-query requests share one encoder forward and one collection query, per index
+batchers = {name: MicroBatcher(s, max_batch_size=16, max_wait_ms=5.0) for name, s in searchers.items()}
+batcher = batchers[DEFAULT_INDEX]
+
+def index_name(requested):
+    """The index a request asked for (the default when it names none), or None if it isn't served"""
+    name = requested or DEFAULT_INDEX
+    return name if name in searchers else None
 
 # Configure image directories
 IMAGES_DIR = os.path.join(os.path.dirname(__file__), "images")
@@ -21,12 +72,40 @@ THUMBNAILS_DIR = os.path.join(os.path.dirname(__file__), "thumbnails")
 # Create thumbnails directory if it doesn't exist
 os.makedirs(THUMBNAILS_DIR, exist_ok=True)
 
-def create_thumbnail(image_path, thumbnail_path, size=(200, 200)):
-    """Create a thumbnail for an image if it doesn't exist"""
-    if not os.path.exists(thumbnail_path):
-        with Image.open(image_path) as img:
-            img.thumbnail(size)
-            img.save(thumbnail_path, "JPEG")
+# Thumbnails packed by `anime_clip_processor.py --thumbnail-store` take precedence over THUMBNAILS_DIR
+THUMBNAILS_STORE = os.path.join(os.path.dirname(__file__), "thumbnails.pack")
+thumbnail_store = PackedStore(THUMBNAILS_STORE, readonly=True) if PackedStore.is_store(THUMBNAILS_STORE) else None
+
+# Thumbnails are written at ingestion (thumbnails.py); clients may cache them for a day
+# and revalidate with the ETag/Last-Modified that send_from_directory adds
+THUMBNAIL_MAX_AGE = 24 * 60 * 60
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    # Label by route pattern so every thumbnail counts as one endpoint
+    current_endpoint.set(request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = current_endpoint.get()
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+def format_result(result):
+    """Shape a search result for the API; its thumbnails are served from /thumbnails/<id>
+
+    id is the first of THUMBNAIL_SIZES/THUMBNAIL_FORMATS; thumbnails lists every configured variant.
+    """
+    variants = thumbnail_variants(result['image_id'])
+    return {
+        'name': result['jikan_data']['name'] if result.get('jikan_data') else result['character_name'],
+        'score': result['similarity_score'],
+        'id': variants[0]['id'],
+        'thumbnails': variants,
+        'jikan_data': result.get('jikan_data')
+    }
 
 @app.route('/search/text', methods=['POST'])
 def text_search():
@@ -35,32 +114,20 @@ def text_search():
         if not data or 'query' not in data:
             return jsonify({'error': 'No query provided'}), 400
 
+        index = index_name(data.get('index'))
+        if index is None:
+            return jsonify({'error': f"Unknown index: {data['index']}"}), 400
+
         # Get optional parameters with defaults
         top_k = data.get('top_k', 5)
         threshold = data.get('threshold', 0.0)
 
         # Perform text search
-        results = searcher.search(data['query'], top_k=top_k, threshold=threshold)
+        results = batchers[index].search(data['query'], top_k=top_k, threshold=threshold)
         
         # Format results
-        formatted_results = []
-        for result in results:
-            # Create thumbnail if it doesn't exist
-            image_id = result['image_id']
-            image_path = os.path.join(IMAGES_DIR, f"{image_id}.jpg")
-            thumbnail_path = os.path.join(THUMBNAILS_DIR, f"{image_id}.jpg")
-            
-            if os.path.exists(image_path):
-                create_thumbnail(image_path, thumbnail_path)
-                
-            formatted_results.append({
-                'name': result['jikan_data']['name'] if result.get('jikan_data') else result['character_name'],
-                'score': result['similarity_score'],
-                'id': f"{image_id}.jpg",
-                'jikan_data': result.get('jikan_data')
-            })
-
-        return jsonify({'results': formatted_results})
+        with timed_stage("serialize", searchers[index].embedding_model_id):
+            return jsonify({'results': [format_result(result) for result in results]})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -75,39 +142,164 @@ def image_search():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
+        index = index_name(request.form.get('index'))
+        if index is None:
+            return jsonify({'error': f"Unknown index: {request.form['index']}"}), 400
+
         # Get optional parameters with defaults
         top_k = int(request.form.get('top_k', 5))
         threshold = float(request.form.get('threshold', 0.0))
 
         # Read and process the image
         image_bytes = file.read()
-        results = searcher.search_by_image(image_bytes, top_k=top_k, threshold=threshold)
+        results = batchers[index].search_by_image(image_bytes, top_k=top_k, threshold=threshold)
         
         # Format results
-        formatted_results = []
-        for result in results:
-            image_id = result['image_id']
-            image_path = os.path.join(IMAGES_DIR, f"{image_id}.jpg")
-            thumbnail_path = os.path.join(THUMBNAILS_DIR, f"{image_id}.jpg")
-            
-            if os.path.exists(image_path):
-                create_thumbnail(image_path, thumbnail_path)
-                
-            formatted_results.append({
-                'name': result['jikan_data']['name'] if result.get('jikan_data') else result['character_name'],
-                'score': result['similarity_score'],
-                'id': f"{image_id}.jpg",
-                'jikan_data': result.get('jikan_data')
-            })
-
-        return jsonify({'results': formatted_results})
+        with timed_stage("serialize", searchers[index].embedding_model_id):
+            return jsonify({'results': [format_result(result) for result in results]})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def stream_search(future):
+    """NDJSON lines: the hits as soon as the vector query returns, then each enrichment as it arrives
+
+    {"type": "results", "results": [...]} comes first (jikan_data still null), then
+    {"type": "enrichment", "index": i, "jikan_data": {...}} per hit, then {"type": "done"}.
+    """
+    try:
+        results = future.result()
+        yield json.dumps({'type': 'results', 'results': [format_result(result) for result in results]}) + "\n"
+
+        indices = {}
+        for i, result in enumerate(results):
+            indices.setdefault(result['character_name'], []).append(i)
+        for name, jikan_data in searcher.jikan.fetch_as_completed(indices):
+            for i in indices[name]:
+                yield json.dumps({'type': 'enrichment', 'index': i, 'jikan_data': jikan_data}) + "\n"
+        yield json.dumps({'type': 'done'}) + "\n"
+
+    except Exception as e:
+        yield json.dumps({'type': 'error', 'error': str(e)}) + "\n"
+
+@app.route('/search/text/stream', methods=['POST'])
+def text_search_stream():
+    data = request.get_json(silent=True)
+    if not data or 'query' not in data:
+        return jsonify({'error': 'No query provided'}), 400
+
+    index = index_name(data.get('index'))
+    if index is None:
+        return jsonify({'error': f"Unknown index: {data['index']}"}), 400
+
+    # Submitted before the response starts, so encoding overlaps with sending headers
+    future = batchers[index].submit_text(data['query'], data.get('top_k', 5), data.get('threshold', 0.0))
+    return Response(stream_search(future), mimetype='application/x-ndjson')
+
+@app.route('/search/image/stream', methods=['POST'])
+def image_search_stream():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    index = index_name(request.form.get('index'))
+    if index is None:
+        return jsonify({'error': f"Unknown index: {request.form['index']}"}), 400
+    try:
+        top_k = int(request.form.get('top_k', 5))
+        threshold = float(request.form.get('threshold', 0.0))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    future = batchers[index].submit_image(file.read(), top_k, threshold)
+    return Response(stream_search(future), mimetype='application/x-ndjson')
+
+@app.route('/search/batch', methods=['POST'])
+def batch_search():
+    """Many queries in one request: JSON {"queries": [...]} or multipart "queries"/"files" fields"""
+    try:
+        if request.is_json:
+            data = request.get_json()
+            queries = data.get('queries', [])
+            images = []
+            top_k = data.get('top_k', 5)
+            threshold = data.get('threshold', 0.0)
+            requested = data.get('index')
+        else:
+            queries = request.form.getlist('queries')
+            images = [f.read() for f in request.files.getlist('files')]
+            top_k = int(request.form.get('top_k', 5))
+            threshold = float(request.form.get('threshold', 0.0))
+            requested = request.form.get('index')
+
+        if not queries and not images:
+            return jsonify({'error': 'No queries or files provided'}), 400
+        index = index_name(requested)
+        if index is None:
+            return jsonify({'error': f"Unknown index: {requested}"}), 400
+
+        # One result list per query: text queries first, then files, in request order
+        batch_results = searchers[index].search_batch(texts=queries, images=images, top_k=top_k, threshold=threshold)
+
+        with timed_stage("serialize", searchers[index].embedding_model_id):
+            return jsonify({'results': [
+                [format_result(result) for result in results] for results in batch_results
+            ]})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def ensure_thumbnail(filename):
+    """Create a missing configured thumbnail for an image added since the last ingestion run"""
+    variant = parse_thumbnail_name(filename)
+    if variant is None or os.path.basename(filename) != filename:
+        return
+    image_id, size, fmt = variant
+    image_path = os.path.join(IMAGES_DIR, f"{image_id}.jpg")
+    if os.path.exists(image_path) and not os.path.exists(os.path.join(THUMBNAILS_DIR, filename)):
+        generate_thumbnail(image_path, THUMBNAILS_DIR, sizes=(size,), formats=(fmt,))
+
+def serve_packed_thumbnail(filename):
+    entry = thumbnail_store.stat(filename)
+    if entry is None:
+        # Pick up thumbnails appended by an ingestion run since the last lookup
+        thumbnail_store.refresh()
+        entry = thumbnail_store.stat(filename)
+    if entry is None:
+        return jsonify({'error': 'Not found'}), 404
+
+    response = Response(thumbnail_store.get(filename), mimetype=mimetypes.guess_type(filename)[0])
+    response.set_etag(entry.sha256)
+    response.last_modified = entry.mtime_ns / 1e9
+    response.cache_control.public = True
+    response.cache_control.max_age = THUMBNAIL_MAX_AGE
+    return response.make_conditional(request)
+
 @app.route('/thumbnails/<path:filename>')
 def serve_thumbnail(filename):
-    return send_from_directory(THUMBNAILS_DIR, filename)
+    with timed_stage("thumbnail"):
+        if thumbnail_store is not None:
+            return serve_packed_thumbnail(filename)
+        ensure_thumbnail(filename)
+        response = send_from_directory(THUMBNAILS_DIR, filename, max_age=THUMBNAIL_MAX_AGE)
+        response.cache_control.public = True
+        return response
+
+def describe_indexes():
+    """Name and model of every served index, default first"""
+    return [{'name': name, 'model': s.embedding_model_id, 'default': name == DEFAULT_INDEX}
+            for name, s in searchers.items()]
+
+@app.route('/indexes')
+def list_indexes():
+    return jsonify({'indexes': describe_indexes()})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of request, stage and cache metrics"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import mimetypes
+import os
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# Same indexes, micro-batchers and thumbnail settings as the Flask app, so both entry points
+# return identical results. Inference runs on each index's batcher thread, which bounds
+# it no matter how many requests are in flight; the event loop only awaits it.
+from app import (THUMBNAIL_MAX_AGE, THUMBNAILS_DIR, batchers, describe_indexes, ensure_thumbnail, format_result,
+                 index_name, searcher, searchers, thumbnail_store)
+from metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, current_endpoint, timed_stage
+
+async def enrich(results):
+    """Non-blocking version of AnimeImageSearch.enrich_results (every index shares one Jikan client)"""
+    with timed_stage("enrichment", searcher.embedding_model_id):
+        jikan_data = await searcher.jikan.fetch_many_async(r['character_name'] for r in results)
+    for result in results:
+        result['jikan_data'] = jikan_data[result['character_name']]
+    return results
+
+async def run_searches(futures):
+    """Wait for batcher futures without holding a thread, then enrich every result list"""
+    batch_results = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+    return await asyncio.gather(*(enrich(results) for results in batch_results))
+
+async def text_search(request: Request):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data or 'query' not in data:
+            return JSONResponse({'error': 'No query provided'}, status_code=400)
+        index = index_name(data.get('index'))
+        if index is None:
+            return JSONResponse({'error': f"Unknown index: {data['index']}"}, status_code=400)
+
+        top_k = data.get('top_k', 5)
+        threshold = data.get('threshold', 0.0)
+        (results,) = await run_searches([batchers[index].submit_text(data['query'], top_k, threshold)])
+        with timed_stage("serialize", searchers[index].embedding_model_id):
+            return JSONResponse({'results': [format_result(result) for result in results]})
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def image_search(request: Request):
+    try:
+        form = await request.form()
+        file = form.get('file')
+        if file is None or isinstance(file, str):
+            return JSONResponse({'error': 'No file provided'}, status_code=400)
+        if file.filename == '':
+            return JSONResponse({'error': 'No file selected'}, status_code=400)
+        index = index_name(form.get('index'))
+        if index is None:
+            return JSONResponse({'error': f"Unknown index: {form['index']}"}, status_code=400)
+
+        top_k = int(form.get('top_k', 5))
+        threshold = float(form.get('threshold', 0.0))
+        image_bytes = await file.read()
+        (results,) = await run_searches([batchers[index].submit_image(image_bytes, top_k, threshold)])
+        with timed_stage("serialize", searchers[index].embedding_model_id):
+            return JSONResponse({'results': [format_result(result) for result in results]})
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def stream_search(future):
+    """Same NDJSON stream as app.stream_search, without holding a thread while waiting"""
+    try:
+        results = await asyncio.wrap_future(future)
+        yield json.dumps({'type': 'results', 'results': [format_result(result) for result in results]}) + "\n"
+
+        indices = {}
+        for i, result in enumerate(results):
+            indices.setdefault(result['character_name'], []).append(i)
+        async for name, jikan_data in searcher.jikan.fetch_as_completed_async(indices):
+            for i in indices[name]:
+                yield json.dumps({'type': 'enrichment', 'index': i, 'jikan_data': jikan_data}) + "\n"
+        yield json.dumps({'type': 'done'}) + "\n"
+
+    except Exception as e:
+        yield json.dumps({'type': 'error', 'error': str(e)}) + "\n"
+
+async def text_search_stream(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or 'query' not in data:
+        return JSONResponse({'error': 'No query provided'}, status_code=400)
+    index = index_name(data.get('index'))
+    if index is None:
+        return JSONResponse({'error': f"Unknown index: {data['index']}"}, status_code=400)
+
+    future = batchers[index].submit_text(data['query'], data.get('top_k', 5), data.get('threshold', 0.0))
+    return StreamingResponse(stream_search(future), media_type='application/x-ndjson')
+
+async def image_search_stream(request: Request):
+    form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        return JSONResponse({'error': 'No file provided'}, status_code=400)
+    if file.filename == '':
+        return JSONResponse({'error': 'No file selected'}, status_code=400)
+    index = index_name(form.get('index'))
+    if index is None:
+        return JSONResponse({'error': f"Unknown index: {form['index']}"}, status_code=400)
+
+    try:
+        top_k = int(form.get('top_k', 5))
+        threshold = float(form.get('threshold', 0.0))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    future = batchers[index].submit_image(await file.read(), top_k, threshold)
+    return StreamingResponse(stream_search(future), media_type='application/x-ndjson')
+
+async def batch_search(request: Request):
+    """Many queries in one request: JSON {"queries": [...]} or multipart "queries"/"files" fields"""
+    try:
+        if request.headers.get('content-type', '').startswith('application/json'):
+            data = await request.json()
+            queries = data.get('queries', [])
+            images = []
+            top_k = data.get('top_k', 5)
+            threshold = data.get('threshold', 0.0)
+            requested = data.get('index')
+        else:
+            form = await request.form()
+            queries = form.getlist('queries')
+            images = [await f.read() for f in form.getlist('files') if not isinstance(f, str)]
+            top_k = int(form.get('top_k', 5))
+            threshold = float(form.get('threshold', 0.0))
+            requested = form.get('index')
+
+        if not queries and not images:
+            return JSONResponse({'error': 'No queries or files provided'}, status_code=400)
+        index = index_name(requested)
+        if index is None:
+            return JSONResponse({'error': f"Unknown index: {requested}"}, status_code=400)
+
+        # Submitted one by one, the batcher coalesces them with whatever else is in flight
+        batcher = batchers[index]
+        futures = ([batcher.submit_text(query, top_k, threshold) for query in queries]
+                   + [batcher.submit_image(image, top_k, threshold) for image in images])
+        batch_results = await run_searches(futures)
+        with timed_stage("serialize", searchers[index].embedding_model_id):
+            return JSONResponse({'results': [
+                [format_result(result) for result in results] for results in batch_results
+            ]})
+
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+def not_modified(request: Request, etag: str, mtime_ns: int) -> bool:
+    """Whether the client's cached copy is still valid per If-None-Match / If-Modified-Since"""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(mtime_ns // 1_000_000_000) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def cache_headers(etag: str, mtime_ns: int) -> dict:
+    return {
+        'etag': etag,
+        'last-modified': formatdate(mtime_ns / 1e9, usegmt=True),
+        'cache-control': f'public, max-age={THUMBNAIL_MAX_AGE}',
+    }
+
+async def serve_thumbnail(request: Request):
+    filename = request.path_params['filename']
+
+    if thumbnail_store is not None:
+        entry = thumbnail_store.stat(filename)
+        if entry is None:
+            # Pick up thumbnails appended by an ingestion run since the last lookup
+            thumbnail_store.refresh()
+            entry = thumbnail_store.stat(filename)
+        if entry is None:
+            return JSONResponse({'error': 'Not found'}, status_code=404)
+        etag = f'"{entry.sha256}"'
+        headers = cache_headers(etag, entry.mtime_ns)
+        if not_modified(request, etag, entry.mtime_ns):
+            return Response(status_code=304, headers=headers)
+        return Response(thumbnail_store.get(filename), media_type=mimetypes.guess_type(filename)[0], headers=headers)
+
+    if os.path.basename(filename) != filename:
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    with timed_stage("thumbnail"):
+        await run_in_threadpool(ensure_thumbnail, filename)
+    path = os.path.join(THUMBNAILS_DIR, filename)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = cache_headers(etag, stat.st_mtime_ns)
+    if not_modified(request, etag, stat.st_mtime_ns):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers)
+
+async def list_indexes(request: Request):
+    return JSONResponse({'indexes': describe_indexes()})
+
+async def metrics(request: Request):
+    return Response(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+class RequestMetrics:
+    """Sets the endpoint label for stage metrics and records request latency and status like app.py"""
+
+    # Same labels as the Flask routes, so dashboards work against either entry point
+    ENDPOINTS = {'/search/text', '/search/image', '/search/batch', '/search/text/stream',
+                 '/search/image/stream', '/indexes', '/metrics'}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        path = scope['path']
+        if path.startswith('/thumbnails/'):
+            endpoint = '/thumbnails/<path:filename>'
+        else:
+            endpoint = path if path in self.ENDPOINTS else 'unmatched'
+        current_endpoint.set(endpoint)
+        start = time.perf_counter()
+
+        async def send_with_metrics(message):
+            if message['type'] == 'http.response.start':
+                REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+                REQUESTS.inc(endpoint=endpoint, status=message['status'])
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
+
+app = Starlette(
+    routes=[
+        Route('/search/text', text_search, methods=['POST']),
+        Route('/search/image', image_search, methods=['POST']),
+        Route('/search/text/stream', text_search_stream, methods=['POST']),
+        Route('/search/image/stream', image_search_stream, methods=['POST']),
+        Route('/search/batch', batch_search, methods=['POST']),
+        Route('/thumbnails/{filename:path}', serve_thumbnail, methods=['GET', 'HEAD']),
+        Route('/indexes', list_indexes, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(RequestMetrics),
+        # Enable CORS for all routes
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+    ],
+)
+
+if __name__ == '__main__':
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the search API on an ASGI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    # One process: the model and collection are loaded once and shared by every connection
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, NamedTuple, Optional
+
+from metrics import current_endpoint
+
+class _Request(NamedTuple):
+    kind: str            # "text" or "image"
+    payload: object      # query string or image bytes
+    top_k: int
+    threshold: float
+    future: Future
+    endpoint: str        # metrics label of the submitting request
+
+class MicroBatcher:
+    """Coalesces concurrent searches into one batched forward pass and one vector query
+
+    Requests queue up while a batch is running; the worker then takes up to
+    max_batch_size of them, waiting at most max_wait_ms for more. A lone request after
+    a lone request is flushed straight away, so a quiet server pays no extra latency.
+    Enrichment is left to the calling threads so slow Jikan lookups never hold up the
+    next batch.
+    """
+
+    def __init__(self, searcher, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.searcher = searcher
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: queue.Queue[Optional[_Request]] = queue.Queue()
+        self._last_batch_size = 1
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit_text(self, query: str, top_k: int = 5, threshold: float = 0.0) -> Future:
+        return self._submit("text", query, top_k, threshold)
+
+    def submit_image(self, image_bytes: bytes, top_k: int = 5, threshold: float = 0.0) -> Future:
+        return self._submit("image", image_bytes, top_k, threshold)
+
+    def search(self, query: str, top_k: int = 5, threshold: float = 0.0) -> List[dict]:
+        """Drop-in for AnimeImageSearch.search"""
+        return self.searcher.enrich_results(self.submit_text(query, top_k, threshold).result())
+
+    def search_by_image(self, image_bytes: bytes, top_k: int = 5, threshold: float = 0.0) -> List[dict]:
+        """Drop-in for AnimeImageSearch.search_by_image"""
+        return self.searcher.enrich_results(self.submit_image(image_bytes, top_k, threshold).result())
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    def _submit(self, kind: str, payload, top_k: int, threshold: float) -> Future:
+        future = Future()
+        # Bad parameters fail this request alone, before it can join a batch
+        try:
+            top_k = int(top_k)
+            threshold = float(threshold)
+        except (TypeError, ValueError) as e:
+            future.set_exception(ValueError(f"Invalid top_k or threshold: {e}"))
+            return future
+        self._queue.put(_Request(kind, payload, top_k, threshold, future, current_endpoint.get()))
+        return future
+
+    def _collect(self, first: _Request) -> List[_Request]:
+        batch = [first]
+        # Only hold the batch open when requests have recently been arriving together
+        deadline = time.monotonic() + self.max_wait if self._last_batch_size > 1 else None
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic() if deadline is not None else 0
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if request is None:
+                # Shutting down: finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            self._last_batch_size = len(batch)
+            # Stage metrics recorded for the batch go to its endpoint, or "mixed"
+            endpoints = {request.endpoint for request in batch}
+            current_endpoint.set(endpoints.pop() if len(endpoints) == 1 else "mixed")
+            try:
+                self._search(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    self._no_hits(first, e)
+                    continue
+                # Retry one by one so a bad query only fails itself
+                print(f"Error performing batched search: {e}")
+                for request in batch:
+                    if request.future.done():
+                        continue
+                    try:
+                        self._search([request])
+                    except Exception as e:
+                        self._no_hits(request, e)
+
+    def _no_hits(self, request: _Request, error: Exception):
+        """A failed search gets no hits, as AnimeImageSearch.search gives"""
+        print(f"Error performing search: {error}")
+        if not request.future.done():
+            request.future.set_result([])
+
+    def _search(self, batch: List[_Request]):
+        texts = [r for r in batch if r.kind == "text"]
+        images = [r for r in batch if r.kind == "image"]
+        # One query at the largest top_k and loosest threshold, trimmed per request below
+        results = self.searcher.search_batch(
+            texts=[r.payload for r in texts],
+            images=[r.payload for r in images],
+            top_k=max(r.top_k for r in batch),
+            threshold=min(r.threshold for r in batch),
+            enrich=False
+        )
+        for request, hits in zip(texts + images, results):
+            if request.future.done():
+                continue
+            request.future.set_result(
+                [hit for hit in hits if hit['similarity_score'] >= request.threshold][:request.top_k]
+            )
@@ -0,0 +1,223 @@
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import chromadb
+import numpy as np
+import torch
+from PIL import Image
+from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel, CLIPProcessor, CLIPTokenizer
+from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+from anime_clip_processor import ingest
+from embedding_cache import EmbeddingCache
+from jikan_cache import EnrichmentCache
+from semantic_search import AnimeImageSearch
+
+QUERY_WORDS = ["girl", "boy", "long", "short", "blue", "red", "hair", "eyes", "sword", "smile",
+               "green", "clothes", "school", "uniform", "glasses", "cat", "ears", "dark", "armor", "hat"]
+
+def build_tiny_clip(model_dir: str, dim: int = 64, image_size: int = 64, seed: int = 0) -> str:
+    """Save a random small CLIP with a byte-level tokenizer to model_dir and return the path"""
+    torch.manual_seed(seed)
+    # Byte-level vocab with no merges: every character is its own token
+    chars = list(bytes_to_unicode().values())
+    vocab = {token: i for i, token in enumerate(chars + [c + "</w>" for c in chars] + ["<|startoftext|>", "<|endoftext|>"])}
+    with open(os.path.join(model_dir, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(model_dir, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+
+    tokenizer = CLIPTokenizer(os.path.join(model_dir, "vocab.json"), os.path.join(model_dir, "merges.txt"))
+    image_processor = CLIPImageProcessor(
+        size={"shortest_edge": image_size}, crop_size={"height": image_size, "width": image_size}
+    )
+    config = CLIPConfig(
+        text_config=dict(vocab_size=len(vocab), hidden_size=dim, intermediate_size=dim * 4,
+                         num_hidden_layers=2, num_attention_heads=4, max_position_embeddings=77),
+        vision_config=dict(hidden_size=dim, intermediate_size=dim * 4, num_hidden_layers=2,
+                           num_attention_heads=4, image_size=image_size, patch_size=16),
+        projection_dim=dim,
+    )
+    CLIPModel(config).save_pretrained(model_dir)
+    CLIPProcessor(image_processor=image_processor, tokenizer=tokenizer).save_pretrained(model_dir)
+    return model_dir
+
+def build_collection(chroma_path: str, size: int, dim: int, seed: int = 0, batch_size: int = 5000):
+    """Fill a collection with random unit vectors named like scraped characters"""
+    rng = np.random.default_rng(seed)
+    collection = chromadb.PersistentClient(path=chroma_path).get_or_create_collection("anime_clip_embeddings")
+    for start in range(0, size, batch_size):
+        count = min(batch_size, size - start)
+        vectors = rng.normal(size=(count, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[f"Character_{i}" for i in range(start, start + count)],
+            documents=[f"Character {i}" for i in range(start, start + count)],
+            embeddings=vectors.tolist()
+        )
+    return collection
+
+def random_image_bytes(rng: np.random.Generator, size: int = 225) -> bytes:
+    """A noisy JPEG roughly the size of a MAL character image"""
+    pixels = rng.integers(0, 256, size=(size * 3 // 2, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def random_queries(rng: np.random.Generator, count: int) -> List[str]:
+    return [" ".join(rng.choice(QUERY_WORDS, size=rng.integers(3, 9))) for _ in range(count)]
+
+def max_rss_mb() -> Dict[str, float]:
+    """High-water resident memory of this process and of finished child processes"""
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024
+    return {
+        'self_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        'children_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    return {
+        'p50_ms': float(np.percentile(samples_ms, 50)),
+        'p95_ms': float(np.percentile(samples_ms, 95)),
+        'p99_ms': float(np.percentile(samples_ms, 99)),
+        'mean_ms': float(np.mean(samples_ms)),
+        'count': len(samples_ms),
+    }
+
+def timed(fn: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+def bench_ingestion(model_dir: str, work_dir: str, num_images: int, batch_size: int, num_workers: int) -> Dict[str, Any]:
+    """Images/s of anime_clip_processor.ingest over synthetic JPEGs"""
+    rng = np.random.default_rng(1)
+    image_dir = os.path.join(work_dir, "images")
+    os.makedirs(image_dir, exist_ok=True)
+    image_files = []
+    for i in range(num_images):
+        path = os.path.join(image_dir, f"Character_{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(random_image_bytes(rng))
+        image_files.append(path)
+
+    model = CLIPModel.from_pretrained(model_dir).eval()
+    processor = CLIPProcessor.from_pretrained(model_dir)
+    collection = chromadb.PersistentClient(path=os.path.join(work_dir, "ingest_db")).get_or_create_collection(
+        "anime_clip_embeddings"
+    )
+
+    start = time.perf_counter()
+    processed = ingest(image_files, collection, model, processor, torch.device("cpu"),
+                       batch_size=batch_size, num_workers=num_workers)
+    seconds = time.perf_counter() - start
+    return {
+        'images': processed,
+        'seconds': seconds,
+        'images_per_second': processed / seconds if seconds else 0.0,
+        'batch_size': batch_size,
+        'num_workers': num_workers,
+        'memory': max_rss_mb(),
+    }
+
+def bench_search(model_dir: str, chroma_path: str, num_queries: int, top_k: int, warmup: int = 5) -> Dict[str, Any]:
+    """Per-stage latency of text and image search with enrichment and caches out of the way"""
+    searcher = AnimeImageSearch(
+        model_name=model_dir,
+        chroma_path=chroma_path,
+        enrichment_cache=EnrichmentCache(path=None),
+        # Nothing is ever cached, so every query pays for the encoder
+        embedding_cache=EmbeddingCache(max_entries=0),
+    )
+    rng = np.random.default_rng(2)
+    texts = random_queries(rng, num_queries + warmup)
+    images = [random_image_bytes(rng) for _ in range(num_queries + warmup)]
+
+    stages = {name: [] for name in ("text_encode", "text_query", "text_format", "text_total",
+                                    "image_encode", "image_query", "image_format", "image_total")}
+    for i, (text, image) in enumerate(zip(texts, images)):
+        embedding, encode_ms = timed(searcher.encode_texts, [text])
+        results, query_ms = timed(searcher.query_embeddings, [embedding[0]], top_k)
+        _, format_ms = timed(searcher._hits, results, 0, -1.0)
+        _, total_ms = timed(searcher.search, text, top_k=top_k, threshold=-1.0, enrich=False)
+        if i >= warmup:
+            stages['text_encode'].append(encode_ms)
+            stages['text_query'].append(query_ms)
+            stages['text_format'].append(format_ms)
+            stages['text_total'].append(total_ms)
+
+        embeddings, encode_ms = timed(searcher.encode_images, [image])
+        results, query_ms = timed(searcher.query_embeddings, [embeddings[0]], top_k)
+        _, format_ms = timed(searcher._hits, results, 0, -1.0)
+        _, total_ms = timed(searcher.search_by_image, image, top_k=top_k, threshold=-1.0, enrich=False)
+        if i >= warmup:
+            stages['image_encode'].append(encode_ms)
+            stages['image_query'].append(query_ms)
+            stages['image_format'].append(format_ms)
+            stages['image_total'].append(total_ms)
+
+    return {
+        'top_k': top_k,
+        'stages': {name: percentiles(samples) for name, samples in stages.items()},
+        'memory': max_rss_mb(),
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return "unknown"
+
+def main():
+    import argparse
+
+    # No network or GPU needed: a random small CLIP stands in for the pretrained checkpoints
+    parser = argparse.ArgumentParser(description="Offline ingestion and search benchmarks (JSON output for diffing)")
+    parser.add_argument("--collection-size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--ingest-images", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--output", default=None, help="Write results as JSON (default: print)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        model_dir = os.path.join(work_dir, "model")
+        os.makedirs(model_dir)
+        build_tiny_clip(model_dir, dim=args.dim)
+        chroma_path = os.path.join(work_dir, "search_db")
+
+        start = time.perf_counter()
+        build_collection(chroma_path, args.collection_size, args.dim)
+        build_seconds = time.perf_counter() - start
+
+        report = {
+            'commit': git_commit(),
+            'created_at': time.time(),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads(),
+            'params': vars(args),
+            'collection_build_seconds': build_seconds,
+            'search': bench_search(model_dir, chroma_path, args.queries, args.top_k),
+            'ingestion': bench_ingestion(model_dir, work_dir, args.ingest_images, args.batch_size, args.workers),
+        }
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import collections
+import concurrent.futures
+import json
+import os
+import pickle
+import time
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from index_config import hnsw_metadata, open_collection
+from vector_backend import _write_jsonl, verify_snapshot, write_manifest
+
+# Inputs use the snapshot layout from vector_backend.export_snapshot: embeddings.f32.npy,
+# ids.jsonl, documents.jsonl, metadatas.jsonl and manifest.json, so exported snapshots
+# can be loaded back as they are.
+
+def convert_pickle(pickle_path: str, out_dir: str, block_size: int = 65536) -> Dict[str, Any]:
+    """One-time conversion of a misc.py style pickle into a memory-mappable bulk-load directory
+
+    The pickle holds image_embeddings (an array, or a list with None for failed images),
+    character_names and image_paths. Rows without an embedding are dropped; the rest keep
+    the char_{index} ids the old loader gave them.
+    """
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+
+    vectors = data["image_embeddings"]
+    names = data["character_names"]
+    paths = data.get("image_paths") or [None] * len(names)
+    if isinstance(vectors, np.ndarray) and vectors.dtype != object:
+        keep = list(range(len(vectors)))
+    else:
+        keep = [i for i, vector in enumerate(vectors) if vector is not None]
+    if not keep:
+        raise ValueError(f"No embeddings in {pickle_path}")
+    dim = int(np.asarray(vectors[keep[0]]).reshape(-1).shape[0])
+
+    os.makedirs(out_dir, exist_ok=True)
+    embeddings = np.lib.format.open_memmap(
+        os.path.join(out_dir, "embeddings.f32.npy"), mode="w+", dtype=np.float32, shape=(len(keep), dim)
+    )
+    for start in range(0, len(keep), block_size):
+        rows = keep[start:start + block_size]
+        block = np.stack([np.asarray(vectors[i], dtype=np.float32).reshape(-1) for i in rows])
+        if block.shape[1] != dim:
+            raise ValueError(f"Embeddings in {pickle_path} have mixed dimensions ({dim} and {block.shape[1]})")
+        # Same invariant as exported snapshots: rows are unit length
+        embeddings[start:start + len(rows)] = block / np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+    embeddings.flush()
+
+    _write_jsonl(os.path.join(out_dir, "ids.jsonl"), [f"char_{i}" for i in keep], "w")
+    _write_jsonl(os.path.join(out_dir, "documents.jsonl"), [names[i] for i in keep], "w")
+    _write_jsonl(os.path.join(out_dir, "metadatas.jsonl"),
+                 [{"file_path": paths[i], "description": ""} if paths[i] else None for i in keep], "w")
+
+    return write_manifest(out_dir, {
+        'collection': None,
+        'count': len(keep),
+        'dim': dim,
+        'created_at': time.time(),
+        'source': {'pickle': os.path.abspath(pickle_path)},
+    })
+
+def collection_dim(collection) -> Optional[int]:
+    """Embedding dimension of a collection, or None while it is empty"""
+    if collection.count() == 0:
+        return None
+    sample = collection.get(limit=1, include=["embeddings"])
+    return len(sample['embeddings'][0])
+
+def _count_lines(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+def _write_batch(collection, ids: List[str], documents: List[Any], metadatas: List[Any], vectors: np.ndarray) -> int:
+    """Upsert one batch; the list conversion happens here, in the writer thread, one batch at a time"""
+    embeddings = vectors.tolist()
+    # Chroma wants a metadata dict for every row of a call or none at all
+    with_metadata = [i for i, metadata in enumerate(metadatas) if metadata]
+    groups = [(with_metadata, True)]
+    if len(with_metadata) < len(ids):
+        present = set(with_metadata)
+        groups.append(([i for i in range(len(ids)) if i not in present], False))
+    for rows, has_metadata in groups:
+        if rows:
+            collection.upsert(
+                ids=[ids[i] for i in rows],
+                documents=[documents[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows] if has_metadata else None,
+                embeddings=[embeddings[i] for i in rows],
+            )
+    return len(ids)
+
+def bulk_load(collection, source_dir: str, batch_size: int = 5000, num_writers: int = 4, max_batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """Stream a bulk-load directory into a collection with parallel writer threads
+
+    Embeddings are memory-mapped and read one batch at a time, and at most 2 * num_writers
+    batches are in flight, so memory stays flat whatever the size of the input. Rows are
+    upserted, so an interrupted load can simply be run again.
+    """
+    embeddings = np.load(os.path.join(source_dir, "embeddings.f32.npy"), mmap_mode="r")
+    count, dim = embeddings.shape
+    manifest_path = os.path.join(source_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('dim') not in (None, dim):
+            raise ValueError(f"{source_dir}: manifest says {manifest['dim']}-d but embeddings are {dim}-d")
+
+    existing_dim = collection_dim(collection)
+    if existing_dim is not None and existing_dim != dim:
+        raise ValueError(f"Collection {collection.name} holds {existing_dim}-d embeddings, {source_dir} has {dim}-d")
+    for name in ("ids.jsonl", "documents.jsonl", "metadatas.jsonl"):
+        lines = _count_lines(os.path.join(source_dir, name))
+        if lines != count:
+            raise ValueError(f"{source_dir}: {name} has {lines} rows but there are {count} embeddings")
+    if max_batch_size is not None and batch_size > max_batch_size:
+        print(f"Batch size {batch_size} exceeds Chroma's limit, using {max_batch_size}")
+        batch_size = max_batch_size
+
+    written = 0
+    failed = 0
+    start_time = time.perf_counter()
+    with open(os.path.join(source_dir, "ids.jsonl"), encoding="utf-8") as ids_file, \
+            open(os.path.join(source_dir, "documents.jsonl"), encoding="utf-8") as documents_file, \
+            open(os.path.join(source_dir, "metadatas.jsonl"), encoding="utf-8") as metadatas_file, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=num_writers) as executor, \
+            tqdm(total=count, unit="rows", desc="Loading embeddings into ChromaDB") as progress:
+        in_flight = collections.deque()
+
+        def finish_oldest():
+            nonlocal written, failed
+            future, size = in_flight.popleft()
+            try:
+                written += future.result()
+            except Exception as e:
+                failed += size
+                print(f"Error adding batch to ChromaDB: {str(e)}")
+            progress.update(size)
+
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            ids = [json.loads(line) for line in islice(ids_file, size)]
+            documents = [json.loads(line) for line in islice(documents_file, size)]
+            metadatas = [json.loads(line) for line in islice(metadatas_file, size)]
+            vectors = np.asarray(embeddings[offset:offset + size], dtype=np.float32)
+            in_flight.append((executor.submit(_write_batch, collection, ids, documents, metadatas, vectors), size))
+            if len(in_flight) >= 2 * num_writers:
+                finish_oldest()
+        while in_flight:
+            finish_oldest()
+
+    elapsed = time.perf_counter() - start_time
+    return {'rows': written, 'failed': failed, 'dim': dim, 'seconds': elapsed,
+            'rows_per_second': written / elapsed if elapsed else 0.0}
+
+def import_snapshot(chroma_client, snapshot_dir: str, collection_name: Optional[str] = None,
+                    batch_size: int = 5000, num_writers: int = 4) -> Tuple[Any, Dict[str, Any]]:
+    """Verify a snapshot's checksums and load it into a collection; returns (collection, load stats)
+
+    A new collection is created with the exported collection's metadata, so it gets the same
+    distance space and HNSW settings as the one the snapshot came from.
+    """
+    manifest = verify_snapshot(snapshot_dir)
+    name = collection_name or manifest.get('collection') or "anime_clip_embeddings"
+    metadata = manifest.get('collection_metadata') or hnsw_metadata(space=manifest.get('space', "cosine"))
+    collection = open_collection(chroma_client, name, metadata)
+    stats = bulk_load(collection, snapshot_dir, batch_size=batch_size, num_writers=num_writers,
+                      max_batch_size=getattr(chroma_client, "max_batch_size", None))
+    return collection, stats
+
+if __name__ == "__main__":
+    import argparse
+    import chromadb
+
+    parser = argparse.ArgumentParser(description="Bulk-load precomputed embeddings into ChromaDB")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="Convert an embeddings pickle into a bulk-load directory")
+    convert_parser.add_argument("pickle", help="e.g. clip_embeddings_fixed.pkl")
+    convert_parser.add_argument("out", help="Directory to write, e.g. ./clip_embeddings_fixed")
+
+    load_parser = subparsers.add_parser("load", help="Load a bulk-load directory or exported snapshot")
+    load_parser.add_argument("source", help="Directory written by convert or vector_backend.py export")
+    load_parser.add_argument("--chroma-path", default="./chroma_last")
+    load_parser.add_argument("--collection", default="anime_clip_embeddings")
+    load_parser.add_argument("--batch-size", type=int, default=5000)
+    load_parser.add_argument("--writers", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        manifest = convert_pickle(args.pickle, args.out)
+        print(f"Converted {manifest['count']} embeddings ({manifest['dim']}-d) to {args.out}")
+    else:
+        chroma_client = chromadb.PersistentClient(path=args.chroma_path)
+        collection, stats = import_snapshot(chroma_client, args.source, args.collection,
+                                            batch_size=args.batch_size, num_writers=args.writers)
+        print(f"Loaded {stats['rows']} rows ({stats['failed']} failed) in {stats['seconds']:.1f}s "
+              f"({stats['rows_per_second']:.0f} rows/s); collection count: {collection.count()}")
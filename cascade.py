@@ -0,0 +1,157 @@
+import concurrent.futures
+import contextvars
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from metrics import timed_stage
+from semantic_search import AnimeImageSearch
+
+class CascadeSearch:
+    """Two-stage retrieval: a small model's index picks candidates, a large model rescores them
+
+    Only the coarse index is scanned. The fine model's stored embeddings are fetched by id for
+    the candidates alone and scored exactly against the fine query embedding, so results carry
+    large-model similarities at roughly small-model cost. Both indexes must be built from the
+    same images (anime_clip_processor uses the file stem as id). Queries go through both towers
+    at once on two threads.
+
+    Has the same search, search_by_image, search_batch and enrich_results methods as
+    AnimeImageSearch, so it can stand in for one behind MicroBatcher or the apps.
+    """
+
+    def __init__(self, coarse: AnimeImageSearch, fine: AnimeImageSearch, candidates: int = 200):
+        self.coarse = coarse
+        self.fine = fine
+        self.candidates = candidates
+        self.jikan = fine.jikan
+        self.embedding_model_id = f"{coarse.embedding_model_id}>{fine.embedding_model_id}"
+        # One thread per tower
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="cascade")
+
+    def _encode_both(self, texts: List[str], images: List[bytes]):
+        """(coarse, fine) query embeddings, texts first then images, None for undecodable images"""
+        def encode(searcher: AnimeImageSearch) -> List[Optional[np.ndarray]]:
+            embeddings: List[Optional[np.ndarray]] = list(searcher.encode_texts(texts)) if texts else []
+            embeddings.extend(searcher.encode_images(images))
+            return embeddings
+
+        # The copied context keeps the request's metrics endpoint label on the other thread
+        fine = self.executor.submit(contextvars.copy_context().run, encode, self.fine)
+        return encode(self.coarse), fine.result()
+
+    def _rescore(self, candidates: Dict[str, list], fine_query: np.ndarray, stored: Dict[str, np.ndarray],
+                 top_k: int, threshold: float) -> List[dict]:
+        """Rank one query's candidates by fine-model cosine similarity"""
+        ids = [id_ for id_ in candidates['ids'] if id_ in stored]
+        if not ids:
+            return []
+        vectors = np.stack([stored[id_] for id_ in ids])
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        scores = vectors @ fine_query
+        order = np.argsort(-scores)[:top_k]
+
+        by_id = {id_: (doc, metadata) for id_, doc, metadata in
+                 zip(candidates['ids'], candidates['documents'], candidates['metadatas'])}
+        results = []
+        for i in order:
+            if scores[i] < threshold:
+                break
+            doc, metadata = by_id[ids[i]]
+            results.append({
+                'character_name': doc,
+                'image_id': doc.replace(' ', '_'),
+                'similarity_score': float(scores[i]),
+                'metadata': metadata,
+                'jikan_data': None
+            })
+        return results
+
+    def search_batch(self,
+                     texts: Optional[List[str]] = None,
+                     images: Optional[List[bytes]] = None,
+                     top_k: int = 5,
+                     threshold: float = 0.0,
+                     enrich: bool = True) -> List[List[dict]]:
+        """Same contract as AnimeImageSearch.search_batch"""
+        texts = list(texts or [])
+        images = list(images or [])
+        coarse_embeddings, fine_embeddings = self._encode_both(texts, images)
+
+        all_results: List[List[dict]] = [[] for _ in coarse_embeddings]
+        valid = [i for i, embedding in enumerate(coarse_embeddings)
+                 if embedding is not None and fine_embeddings[i] is not None]
+        if valid:
+            results = self.coarse.query_embeddings([coarse_embeddings[i] for i in valid],
+                                                   max(self.candidates, top_k))
+            # One fetch for the union of every query's candidates
+            stored = self.fine.stored_embeddings(list({id_ for ids in results['ids'] for id_ in ids}))
+            with timed_stage("rerank", self.embedding_model_id):
+                for row, i in enumerate(valid):
+                    candidates = {
+                        'ids': results['ids'][row],
+                        'documents': results['documents'][row],
+                        'metadatas': results['metadatas'][row] if results.get('metadatas') else [{}] * len(results['ids'][row]),
+                    }
+                    all_results[i] = self._rescore(candidates, np.asarray(fine_embeddings[i], dtype=np.float32),
+                                                   stored, top_k, threshold)
+            if results['ids'] and not stored:
+                print("None of the coarse candidates are in the fine index; were both built from the same images?")
+
+        if enrich:
+            self.enrich_results([hit for hits in all_results for hit in hits])
+        return all_results
+
+    def search(self, query: str, top_k: int = 5, threshold: float = 0.0, enrich: bool = True) -> List[dict]:
+        try:
+            return self.search_batch(texts=[query], top_k=top_k, threshold=threshold, enrich=enrich)[0]
+        except Exception as e:
+            print(f"Error performing cascade search: {e}")
+            return []
+
+    def search_by_image(self, image_bytes: bytes, top_k: int = 5, threshold: float = 0.0, enrich: bool = True) -> List[dict]:
+        try:
+            return self.search_batch(images=[image_bytes], top_k=top_k, threshold=threshold, enrich=enrich)[0]
+        except Exception as e:
+            print(f"Error performing cascade image search: {e}")
+            return []
+
+    def enrich_results(self, character_results: List[dict]) -> List[dict]:
+        return self.fine.enrich_results(character_results)
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from model_registry import ModelRegistry
+
+    parser = argparse.ArgumentParser(description="Compare cascade retrieval against a full scan of the large model's index")
+    parser.add_argument("query", nargs="+")
+    parser.add_argument("--coarse-chroma", default="./chroma_db")
+    parser.add_argument("--fine-chroma", default="./chroma_last")
+    parser.add_argument("--coarse-model", default=None, help="Defaults to the model recorded in the collection")
+    parser.add_argument("--fine-model", default=None, help="Defaults to the model recorded in the collection")
+    parser.add_argument("--candidates", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    fine = AnimeImageSearch(model_name=args.fine_model, chroma_path=args.fine_chroma, registry=registry)
+    # Enrichment is shared, so the coarse searcher reuses the fine one's client and caches
+    coarse = AnimeImageSearch(model_name=args.coarse_model, chroma_path=args.coarse_chroma,
+                              jikan_client=fine.jikan, registry=registry)
+    cascade = CascadeSearch(coarse, fine, candidates=args.candidates)
+
+    for query in args.query:
+        start = time.perf_counter()
+        exact = fine.search(query, args.top_k, threshold=-1.0, enrich=False)
+        exact_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        cascaded = cascade.search(query, args.top_k, threshold=-1.0, enrich=False)
+        cascade_seconds = time.perf_counter() - start
+
+        overlap = len({r['image_id'] for r in exact} & {r['image_id'] for r in cascaded}) / max(len(exact), 1)
+        print(f"\n'{query}': full scan {exact_seconds * 1000:.1f}ms, cascade {cascade_seconds * 1000:.1f}ms, "
+              f"overlap@{args.top_k} {overlap:.2f}")
+        for result in cascaded:
+            print(f"  {result['character_name']}: {result['similarity_score']:.4f}")
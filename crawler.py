@@ -0,0 +1,311 @@
+import asyncio
+import os
+import random
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from jikan_client import JIKAN_LIMITER, RateLimiter, TokenBucket
+from packed_store import PackedStore
+
+JIKAN_API_BASE = "https://api.jikan.moe/v4"
+
+def safe_file_name(name: str) -> str:
+    """Character name as used for image files and collection ids (same rule as web_scraping.py)"""
+    return name.replace('/', '_').replace('\\', '_').replace(' ', '_')
+
+def parse_anime_characters(data: Dict[str, Any]) -> List[dict]:
+    """Characters of a Jikan /anime/{id}/characters response"""
+    characters = []
+    for entry in data.get('data') or []:
+        character = entry["character"]
+        characters.append({
+            'mal_id': character["mal_id"],
+            'name': character["name"],
+            'image_url': character["images"]["jpg"]["image_url"],
+        })
+    return characters
+
+def default_host_limiters(api_base: str = JIKAN_API_BASE) -> Dict[str, RateLimiter]:
+    """Jikan shares its quota with the search service's JikanClient; the image CDN gets its own budget"""
+    return {
+        urlsplit(api_base).netloc: JIKAN_LIMITER,
+        "cdn.myanimelist.net": RateLimiter([TokenBucket(rate=20, capacity=20)]),
+    }
+
+class CrawlState:
+    """SQLite record of crawled anime ids and of every character's image download
+
+    Characters are keyed by MAL id, so one shared by several anime is downloaded once.
+    """
+
+    def __init__(self, path: str = "./crawl_state.sqlite3"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS anime (
+                id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,           -- done, missing
+                characters INTEGER NOT NULL,
+                crawled_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS characters (
+                mal_id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                image_url TEXT NOT NULL,
+                status TEXT NOT NULL,           -- pending, done, failed (retried), missing, duplicate, undecodable
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS characters_status ON characters (status);
+            CREATE INDEX IF NOT EXISTS characters_file_name ON characters (file_name);
+        """)
+        self.conn.commit()
+
+    def crawled_anime(self) -> set:
+        return {row[0] for row in self.conn.execute("SELECT id FROM anime")}
+
+    def record_anime(self, anime_id: int, status: str, characters: List[dict]) -> List[dict]:
+        """Store an anime's characters and mark it crawled in one transaction; returns the new ones"""
+        now = time.time()
+        new = []
+        with self.conn:
+            for character in characters:
+                file_name = f"{safe_file_name(character['name'])}.jpg"
+                # Different characters with the same name would overwrite each other's image
+                taken = self.conn.execute(
+                    "SELECT 1 FROM characters WHERE file_name = ? AND mal_id != ?", (file_name, character['mal_id'])
+                ).fetchone()
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO characters (mal_id, name, file_name, image_url, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (character['mal_id'], character['name'], file_name, character['image_url'],
+                     "duplicate" if taken else "pending", now)
+                )
+                if cursor.rowcount and not taken:
+                    new.append(dict(character, file_name=file_name))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO anime (id, status, characters, crawled_at) VALUES (?, ?, ?, ?)",
+                (anime_id, status, len(characters), now)
+            )
+        return new
+
+    def pending_characters(self) -> List[dict]:
+        """Characters found by earlier runs whose image was never downloaded or hit an error"""
+        rows = self.conn.execute(
+            "SELECT mal_id, name, file_name, image_url FROM characters WHERE status IN ('pending', 'failed')"
+        )
+        return [{'mal_id': row[0], 'name': row[1], 'file_name': row[2], 'image_url': row[3]} for row in rows]
+
+    def record_download(self, mal_id: int, status: str):
+        with self.conn:
+            self.conn.execute("UPDATE characters SET status = ?, updated_at = ? WHERE mal_id = ?",
+                              (status, time.time(), mal_id))
+
+    def record_files(self, file_names: List[str], status: str):
+        """Set the status of downloads by image file name, e.g. once they are indexed"""
+        now = time.time()
+        with self.conn:
+            # Duplicates share their file name with the character that owns the image
+            self.conn.executemany(
+                "UPDATE characters SET status = ?, updated_at = ? WHERE file_name = ? AND status IN ('pending', 'failed')",
+                [(status, now, file_name) for file_name in file_names]
+            )
+
+    def stats(self) -> Dict[str, int]:
+        counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM characters GROUP BY status").fetchall())
+        counts['anime'] = self.conn.execute("SELECT COUNT(*) FROM anime").fetchone()[0]
+        return counts
+
+    def close(self):
+        self.conn.close()
+
+class DirectorySink:
+    """Writes each image to images_dir as it streams in, renaming into place once complete"""
+
+    def __init__(self, images_dir: str = "./images", chunk_size: int = 64 * 1024):
+        self.images_dir = images_dir
+        self.chunk_size = chunk_size
+        os.makedirs(images_dir, exist_ok=True)
+
+    async def write(self, file_name: str, response: aiohttp.ClientResponse):
+        path = os.path.join(self.images_dir, file_name)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "wb") as f:
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+
+class StoreSink:
+    """Appends each image to a PackedStore instead of a directory of small files"""
+
+    def __init__(self, store: PackedStore):
+        self.store = store
+
+    async def write(self, file_name: str, response: aiohttp.ClientResponse):
+        self.store.put(file_name, await response.read())
+
+class Crawler:
+    """Async anime -> characters -> images crawl with per-host rate limits and resumable state
+
+    Character lists are fetched by a few API workers and every new character goes through a
+    bounded queue to the download workers, so memory stays flat however many ids are crawled.
+    A sink is anything with `async write(file_name, response)`. If write returns True the sink
+    records the character's final status itself (see pipeline.PipelineSink) and it stays pending here.
+    """
+
+    def __init__(self,
+                 state: CrawlState,
+                 sink,
+                 api_base: str = JIKAN_API_BASE,
+                 host_limiters: Optional[Dict[str, RateLimiter]] = None,
+                 default_rate: float = 10.0,
+                 max_connections: int = 32,
+                 api_workers: int = 3,
+                 download_workers: int = 16,
+                 max_retries: int = 4,
+                 timeout: float = 30.0):
+        self.state = state
+        self.sink = sink
+        self.api_base = api_base.rstrip("/")
+        self.host_limiters = host_limiters if host_limiters is not None else default_host_limiters(api_base)
+        self.default_rate = default_rate
+        self.max_connections = max_connections
+        self.api_workers = api_workers
+        self.download_workers = download_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.counts = {'anime': 0, 'missing': 0, 'characters': 0, 'new_characters': 0,
+                       'downloaded': 0, 'missing_images': 0, 'failed': 0}
+
+    def _limiter(self, url: str) -> RateLimiter:
+        host = urlsplit(url).netloc
+        if host not in self.host_limiters:
+            self.host_limiters[host] = RateLimiter([TokenBucket(rate=self.default_rate, capacity=self.default_rate)])
+        return self.host_limiters[host]
+
+    async def _request(self, session: aiohttp.ClientSession, url: str):
+        """GET with the host's rate limit, retrying 429/5xx and connection errors
+
+        Returns an open response (the caller reads and releases it), or None for a definite miss.
+        """
+        limiter = self._limiter(url)
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire_async()
+            retry_after = None
+            try:
+                response = await session.get(url)
+                if response.status == 200:
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                response.release()
+                if response.status != 429 and response.status < 500:
+                    print(f"{url} - Status Code: {response.status}")
+                    return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error fetching {url}: {e}")
+
+            if attempt < self.max_retries:
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else 0.5 * 2 ** attempt
+                await asyncio.sleep(delay + random.uniform(0, 0.25))
+        raise RuntimeError(f"Giving up on {url} after {self.max_retries + 1} attempts")
+
+    async def _crawl_anime(self, session, anime_ids: asyncio.Queue, downloads: asyncio.Queue):
+        while True:
+            anime_id = await anime_ids.get()
+            try:
+                response = await self._request(session, f"{self.api_base}/anime/{anime_id}/characters")
+                if response is None:
+                    self.state.record_anime(anime_id, "missing", [])
+                    self.counts['missing'] += 1
+                    continue
+                async with response:
+                    characters = parse_anime_characters(await response.json())
+                new = self.state.record_anime(anime_id, "done", characters)
+                self.counts['anime'] += 1
+                self.counts['characters'] += len(characters)
+                self.counts['new_characters'] += len(new)
+                print(f"Fetched {len(characters)} characters ({len(new)} new) from Anime ID {anime_id}")
+                for character in new:
+                    # Blocks while the download queue is full
+                    await downloads.put(character)
+            except Exception as e:
+                # Left unrecorded, so the next run retries this id
+                print(f"Error fetching Anime ID {anime_id}: {e}")
+            finally:
+                anime_ids.task_done()
+
+    async def _download(self, session, downloads: asyncio.Queue):
+        while True:
+            character = await downloads.get()
+            try:
+                response = await self._request(session, character['image_url'])
+                if response is None:
+                    # A definite 4xx; unlike errors it isn't retried by later runs
+                    self.state.record_download(character['mal_id'], "missing")
+                    self.counts['missing_images'] += 1
+                    continue
+                async with response:
+                    recorded_by_sink = await self.sink.write(character['file_name'], response)
+                if not recorded_by_sink:
+                    self.state.record_download(character['mal_id'], "done")
+                self.counts['downloaded'] += 1
+            except Exception as e:
+                print(f"Failed to download {character['name']}: {e}")
+                self.state.record_download(character['mal_id'], "failed")
+                self.counts['failed'] += 1
+            finally:
+                downloads.task_done()
+
+    async def run(self, anime_ids: Iterable[int]) -> Dict[str, int]:
+        """Crawl the given anime ids, skipping ones finished by earlier runs; returns this run's counts"""
+        done = self.state.crawled_anime()
+        todo = [anime_id for anime_id in anime_ids if anime_id not in done]
+        anime_queue: asyncio.Queue = asyncio.Queue()
+        for anime_id in todo:
+            anime_queue.put_nowait(anime_id)
+        download_queue: asyncio.Queue = asyncio.Queue(maxsize=self.download_workers * 4)
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            workers = [asyncio.create_task(self._download(session, download_queue))
+                       for _ in range(self.download_workers)]
+            # Images an interrupted run never got to go first
+            pending = self.state.pending_characters()
+            print(f"Anime to crawl: {len(todo)} (skipping {len(done)}), images left over: {len(pending)}")
+            for character in pending:
+                await download_queue.put(character)
+
+            workers += [asyncio.create_task(self._crawl_anime(session, anime_queue, download_queue))
+                        for _ in range(self.api_workers)]
+            await anime_queue.join()
+            await download_queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return self.counts
+
+def crawl(anime_ids: Iterable[int],
+          images_dir: str = "./images",
+          state_path: str = "./crawl_state.sqlite3",
+          store: Optional[str] = None,
+          **crawler_options) -> Dict[str, int]:
+    """Blocking entry point: crawl into images_dir, or into a PackedStore directory if store is given"""
+    state = CrawlState(state_path)
+    packed = PackedStore(store) if store else None
+    sink = StoreSink(packed) if packed is not None else DirectorySink(images_dir)
+    try:
+        start = time.perf_counter()
+        counts = asyncio.run(Crawler(state, sink, **crawler_options).run(anime_ids))
+        elapsed = time.perf_counter() - start
+        print(f"\nCrawl finished in {elapsed:.1f}s: {counts} "
+              f"({counts['downloaded'] / elapsed if elapsed else 0.0:.1f} images/s); totals {state.stats()}")
+        return counts
+    finally:
+        state.close()
+        if packed is not None:
+            packed.close()
@@ -0,0 +1,119 @@
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+def normalize_query(text: str) -> str:
+    """Cache key for a text query; CLIP's tokenizer lowercases and collapses whitespace anyway"""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def content_hash(data: bytes) -> str:
+    """Cache key for an uploaded image: hash of the raw bytes"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def dhash(image: Image.Image, hash_size: int = 16) -> str:
+    """Difference hash of a decoded image; survives re-encoding and resizing of the same picture"""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return np.packbits(bits.flatten()).tobytes().hex()
+
+class EmbeddingCache:
+    """Bounded LRU of query embeddings keyed by (model id, kind, key)
+
+    Limited both by entry count and by the total bytes of the stored vectors. With a
+    path, every embedding is also written to a SQLite warm tier that survives restarts
+    and refills the LRU on a memory miss.
+    """
+
+    def __init__(self,
+                 max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._memory: "OrderedDict[Tuple[str, str, str], np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, kind, key)
+                )
+            """)
+            self._conn.commit()
+
+    def get(self, model: str, kind: str, key: str) -> Optional[np.ndarray]:
+        """Return the cached float32 embedding, or None"""
+        cache_key = (model, kind, key)
+        with self._lock:
+            embedding = self._memory.get(cache_key)
+            if embedding is not None:
+                self._memory.move_to_end(cache_key)
+                self._stats['memory_hits'] += 1
+                return embedding
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND kind = ? AND key = ?", cache_key
+                ).fetchone()
+                if row is not None:
+                    embedding = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(cache_key, embedding)
+                    self._stats['disk_hits'] += 1
+                    return embedding
+
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, model: str, kind: str, key: str, embedding: np.ndarray):
+        cache_key = (model, kind, key)
+        # Read-only so callers can't mutate what other requests get back
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        with self._lock:
+            self._remember(cache_key, embedding)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO embeddings (model, kind, key, vector) VALUES (?, ?, ?, ?)",
+                        (*cache_key, embedding.tobytes())
+                    )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._memory)
+            stats['bytes'] = self._bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _remember(self, cache_key: Tuple[str, str, str], embedding: np.ndarray):
+        previous = self._memory.pop(cache_key, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        self._memory[cache_key] = embedding
+        self._bytes += embedding.nbytes
+        while self._memory and (len(self._memory) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._memory.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self._stats['evictions'] += 1
@@ -0,0 +1,311 @@
+import inspect
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from transformers import CLIPModel, CLIPProcessor
+
+ENCODER_BACKENDS = ("torch", "torch-int8", "torchscript", "onnx")
+
+# Held-out descriptions for checking a quantized encoder against the float model
+EVAL_QUERIES = [
+    "a girl with long blue hair and red eyes",
+    "a small boy with a big smile and green clothes",
+    "a tall man in black armor with a sword",
+    "a girl with cat ears and a school uniform",
+    "an old man with a white beard and glasses",
+    "a boy with spiky blonde hair and an orange jacket",
+    "a woman with short pink hair holding a staff",
+    "a serious man with dark hair and a scar",
+    "a girl with twin tails and a ribbon",
+    "a masked villain with a red cape",
+    "a cheerful girl with brown hair in a ponytail",
+    "a boy wearing a straw hat",
+    "a silver haired swordsman with one eye closed",
+    "a girl in a maid outfit",
+    "a robot with glowing blue eyes",
+    "a young witch with a pointed hat",
+    "a muscular fighter with a headband",
+    "a shy girl with purple hair and glasses",
+    "a demon with horns and a dark coat",
+    "a prince with golden hair and a crown",
+]
+
+class TextTower(torch.nn.Module):
+    """CLIP text tower + projection as a standalone module for export"""
+
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+class VisionTower(torch.nn.Module):
+    """CLIP vision tower + projection as a standalone module for export"""
+
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+class TorchEncoder:
+    """Eager PyTorch CLIPModel; returns unnormalized features as float32 NumPy arrays"""
+
+    def __init__(self, model: CLIPModel, device: str = "cpu"):
+        self.model = model
+        self.device = device
+
+    def encode_text(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            features = self.model.get_text_features(
+                input_ids=torch.as_tensor(input_ids).to(self.device),
+                attention_mask=torch.as_tensor(attention_mask).to(self.device)
+            )
+        return features.cpu().numpy()
+
+    def encode_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            features = self.model.get_image_features(pixel_values=torch.as_tensor(pixel_values).to(self.device))
+        return features.cpu().numpy()
+
+class TorchScriptEncoder:
+    """Frozen TorchScript towers written by export_encoders"""
+
+    def __init__(self, export_dir: str):
+        self.text = torch.jit.load(os.path.join(export_dir, "text.pt"), map_location="cpu")
+        self.vision = torch.jit.load(os.path.join(export_dir, "vision.pt"), map_location="cpu")
+
+    def encode_text(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return self.text(torch.as_tensor(input_ids), torch.as_tensor(attention_mask)).numpy()
+
+    def encode_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return self.vision(torch.as_tensor(pixel_values)).numpy()
+
+class OnnxEncoder:
+    """ONNX Runtime sessions over the towers written by export_encoders"""
+
+    def __init__(self, export_dir: str, num_threads: Optional[int] = None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("The onnx encoder backend needs onnxruntime: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        providers = ["CPUExecutionProvider"]
+        self.text = ort.InferenceSession(os.path.join(export_dir, "text.onnx"), options, providers=providers)
+        self.vision = ort.InferenceSession(os.path.join(export_dir, "vision.onnx"), options, providers=providers)
+
+    def encode_text(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return self.text.run(None, {
+            'input_ids': np.asarray(input_ids, dtype=np.int64),
+            'attention_mask': np.asarray(attention_mask, dtype=np.int64),
+        })[0]
+
+    def encode_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.vision.run(None, {'pixel_values': np.asarray(pixel_values, dtype=np.float32)})[0]
+
+def _example_inputs(processor: CLIPProcessor) -> Dict[str, torch.Tensor]:
+    from PIL import Image
+
+    text = processor(text=["a girl with long blue hair", "a boy"], return_tensors="pt", padding=True)
+    size = processor.image_processor.crop_size
+    image = Image.new("RGB", (size["width"], size["height"]), (127, 127, 127))
+    pixels = processor(images=[image, image], return_tensors="pt")
+    return {'input_ids': text['input_ids'], 'attention_mask': text['attention_mask'],
+            'pixel_values': pixels['pixel_values']}
+
+def export_encoders(model_name: str, export_dir: str, fmt: str = "onnx") -> str:
+    """Export both CLIP towers once, plus the processor, so serving never loads CLIPModel"""
+    if fmt not in ("torchscript", "onnx"):
+        raise ValueError(f"Can't export to {fmt}")
+    os.makedirs(export_dir, exist_ok=True)
+
+    model = CLIPModel.from_pretrained(model_name).eval()
+    processor = CLIPProcessor.from_pretrained(model_name)
+    inputs = _example_inputs(processor)
+    text_tower, vision_tower = TextTower(model).eval(), VisionTower(model).eval()
+
+    # Newer torch releases default to the dynamo exporter; the TorchScript-based one handles dynamic axes here
+    onnx_kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+
+    with torch.no_grad():
+        if fmt == "torchscript":
+            text = torch.jit.trace(text_tower, (inputs['input_ids'], inputs['attention_mask']))
+            vision = torch.jit.trace(vision_tower, (inputs['pixel_values'],))
+            torch.jit.save(torch.jit.freeze(text), os.path.join(export_dir, "text.pt"))
+            torch.jit.save(torch.jit.freeze(vision), os.path.join(export_dir, "vision.pt"))
+        else:
+            torch.onnx.export(
+                text_tower, (inputs['input_ids'], inputs['attention_mask']), os.path.join(export_dir, "text.onnx"),
+                input_names=['input_ids', 'attention_mask'], output_names=['text_embeds'],
+                dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                              'attention_mask': {0: 'batch', 1: 'sequence'},
+                              'text_embeds': {0: 'batch'}},
+                opset_version=17, **onnx_kwargs
+            )
+            torch.onnx.export(
+                vision_tower, (inputs['pixel_values'],), os.path.join(export_dir, "vision.onnx"),
+                input_names=['pixel_values'], output_names=['image_embeds'],
+                dynamic_axes={'pixel_values': {0: 'batch'}, 'image_embeds': {0: 'batch'}},
+                opset_version=17, **onnx_kwargs
+            )
+
+    processor.save_pretrained(export_dir)
+    with open(os.path.join(export_dir, "encoder.json"), "w") as f:
+        json.dump({'format': fmt, 'model_name': model_name, 'dim': model.config.projection_dim}, f, indent=4)
+    return export_dir
+
+def quantize_int8(model: CLIPModel) -> CLIPModel:
+    """Dynamic int8 quantization of every Linear layer in both towers (CPU only)"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_encoder(backend: str, model_name: str, export_dir: Optional[str] = None, device: str = "cpu"):
+    """Build the encoder for a backend; exported backends read export_dir instead of the checkpoint"""
+    if backend == "torch":
+        model = CLIPModel.from_pretrained(model_name).to(device)
+        model.eval()
+        return TorchEncoder(model, device)
+    if backend == "torch-int8":
+        if str(device) != "cpu":
+            raise ValueError("The torch-int8 encoder backend only runs on CPU")
+        model = CLIPModel.from_pretrained(model_name)
+        model.eval()
+        return TorchEncoder(quantize_int8(model), "cpu")
+
+    if export_dir is None:
+        raise ValueError(f"The {backend} encoder backend needs an export directory")
+    with open(os.path.join(export_dir, "encoder.json")) as f:
+        info = json.load(f)
+    if info['format'] != backend:
+        raise ValueError(f"{export_dir} holds a {info['format']} export, not {backend}")
+    if info['model_name'] != model_name:
+        raise ValueError(f"{export_dir} was exported from {info['model_name']}, not {model_name}")
+    if backend == "torchscript":
+        return TorchScriptEncoder(export_dir)
+    if backend == "onnx":
+        return OnnxEncoder(export_dir)
+    raise ValueError(f"Unknown encoder backend: {backend}")
+
+def check_parity(model_name: str, export_dir: str, atol: float = 1e-3) -> Dict[str, float]:
+    """Compare normalized embeddings from an export against eager PyTorch; raises if they drift past atol"""
+    with open(os.path.join(export_dir, "encoder.json")) as f:
+        backend = json.load(f)['format']
+    processor = CLIPProcessor.from_pretrained(model_name)
+    reference = load_encoder("torch", model_name)
+    exported = load_encoder(backend, model_name, export_dir)
+
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    # Different lengths than the export examples, so dynamic shapes are exercised
+    texts = ["blue hair", "a small boy with a big smile and green clothes", "cat ears, red eyes and a long black coat"]
+    size = processor.image_processor.crop_size
+    images = [Image.fromarray(rng.integers(0, 256, size=(size["height"] + 17, size["width"] + 5, 3), dtype=np.uint8))
+              for _ in range(3)]
+    text_inputs = processor(text=texts, return_tensors="np", padding=True)
+    pixel_values = processor(images=images, return_tensors="np")['pixel_values']
+
+    def normalize(x):
+        return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+    diffs = {
+        'text_max_abs_diff': float(np.abs(
+            normalize(reference.encode_text(text_inputs['input_ids'], text_inputs['attention_mask'])) -
+            normalize(exported.encode_text(text_inputs['input_ids'], text_inputs['attention_mask']))
+        ).max()),
+        'image_max_abs_diff': float(np.abs(
+            normalize(reference.encode_pixels(pixel_values)) - normalize(exported.encode_pixels(pixel_values))
+        ).max()),
+    }
+    if max(diffs.values()) > atol:
+        raise AssertionError(f"{backend} export of {model_name} differs from PyTorch beyond {atol}: {diffs}")
+    return diffs
+
+def quantization_report(searcher, texts: List[str] = EVAL_QUERIES, k: int = 10) -> Dict[str, float]:
+    """Top-k overlap and encoder speed of a searcher's encoder against the float32 PyTorch model
+
+    Both sets of query embeddings are run against the searcher's own index, so the overlap
+    is measured on the results users would actually see.
+    """
+    reference = load_encoder("torch", searcher.model_name)
+    inputs = searcher.processor(text=list(texts), return_tensors="np", padding=True)
+
+    def encode(encoder) -> tuple:
+        start = time.perf_counter()
+        features = encoder.encode_text(inputs['input_ids'], inputs['attention_mask'])
+        seconds = time.perf_counter() - start
+        return features / np.linalg.norm(features, axis=1, keepdims=True), seconds
+
+    # Warm both up once so the timings compare steady-state forwards
+    encode(reference)
+    encode(searcher.encoder)
+    reference_embeddings, reference_seconds = encode(reference)
+    candidate_embeddings, candidate_seconds = encode(searcher.encoder)
+
+    reference_ids = searcher.query_embeddings(reference_embeddings, k)['ids']
+    candidate_ids = searcher.query_embeddings(candidate_embeddings, k)['ids']
+    overlaps = [len(set(r) & set(c)) / len(r) for r, c in zip(reference_ids, candidate_ids) if r]
+    return {
+        'topk_overlap': float(np.mean(overlaps)) if overlaps else 0.0,
+        'min_topk_overlap': float(np.min(overlaps)) if overlaps else 0.0,
+        'mean_cosine_to_float': float(np.mean(np.sum(reference_embeddings * candidate_embeddings, axis=1))),
+        'speedup': reference_seconds / candidate_seconds if candidate_seconds else 0.0,
+        'queries': len(overlaps),
+        'k': k,
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export CLIP towers for CPU serving and check them against PyTorch")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("--model", default="openai/clip-vit-large-patch14-336")
+    export_parser.add_argument("--format", choices=["onnx", "torchscript"], default="onnx")
+    export_parser.add_argument("--out", default="./encoders/clip-vit-large-patch14-336-onnx")
+    export_parser.add_argument("--atol", type=float, default=1e-3)
+
+    parity_parser = subparsers.add_parser("parity")
+    parity_parser.add_argument("--model", default="openai/clip-vit-large-patch14-336")
+    parity_parser.add_argument("--export-dir", default="./encoders/clip-vit-large-patch14-336-onnx")
+    parity_parser.add_argument("--atol", type=float, default=1e-3)
+
+    quant_parser = subparsers.add_parser("quant-check", help="Compare an encoder backend's top-k results to float32")
+    quant_parser.add_argument("--model", default="openai/clip-vit-large-patch14-336")
+    quant_parser.add_argument("--backend", choices=ENCODER_BACKENDS, default="torch-int8")
+    quant_parser.add_argument("--export-dir", default=None)
+    quant_parser.add_argument("--chroma-path", default="./chroma_last")
+    quant_parser.add_argument("--queries-file", default=None, help="One held-out query per line")
+    quant_parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "quant-check":
+        from semantic_search import AnimeImageSearch
+
+        texts = EVAL_QUERIES
+        if args.queries_file:
+            with open(args.queries_file) as f:
+                texts = [line.strip() for line in f if line.strip()]
+        searcher = AnimeImageSearch(model_name=args.model, chroma_path=args.chroma_path,
+                                    encoder_backend=args.backend, encoder_dir=args.export_dir)
+        print(json.dumps(quantization_report(searcher, texts, args.k), indent=4))
+    else:
+        if args.command == "export":
+            export_encoders(args.model, args.out, args.format)
+            export_dir = args.out
+        else:
+            export_dir = args.export_dir
+        # Every export is checked before it can be served
+        print(f"Parity OK for {export_dir}: {check_parity(args.model, export_dir, args.atol)}")
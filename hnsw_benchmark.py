@@ -0,0 +1,107 @@
+import itertools
+import json
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import chromadb
+import numpy as np
+
+from index_config import hnsw_metadata, set_search_ef
+from vector_backend import NumpyBackend, export_snapshot, sample_queries
+
+def build_collection(chroma_client, name: str, snapshot: NumpyBackend, metadata: Dict[str, Any], batch_size: int = 5000):
+    """Load a snapshot into a fresh collection and return it with the build time in seconds"""
+    collection = chroma_client.create_collection(name=name, metadata=metadata)
+    start = time.perf_counter()
+    for i in range(0, snapshot.count(), batch_size):
+        collection.add(
+            ids=snapshot.ids[i:i + batch_size],
+            embeddings=np.asarray(snapshot.embeddings[i:i + batch_size]).tolist()
+        )
+    return collection, time.perf_counter() - start
+
+def measure(collection, queries: np.ndarray, exact_ids: List[List[str]], k: int) -> Dict[str, float]:
+    """Per-query latency percentiles and recall@k of a collection against exact ids"""
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, exact_ids):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(result['ids'][0]) & set(expected)) / len(expected))
+    return {
+        'recall_at_k': float(np.mean(recalls)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+def sweep(snapshot: NumpyBackend,
+          spaces: List[str],
+          ms: List[int],
+          construction_efs: List[int],
+          search_efs: List[int],
+          k: int = 10,
+          num_queries: int = 200) -> List[Dict[str, Any]]:
+    """Build one index per (space, M, construction_ef) and query it at every search_ef"""
+    queries = sample_queries(snapshot.embeddings, num_queries)
+    exact_ids = snapshot.query(queries, k)['ids']
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        chroma_client = chromadb.PersistentClient(path=tmp)
+        for n, (space, m, construction_ef) in enumerate(itertools.product(spaces, ms, construction_efs)):
+            collection, build_seconds = build_collection(
+                chroma_client, f"hnsw_sweep_{n}", snapshot,
+                hnsw_metadata(space, m, construction_ef, search_efs[0])
+            )
+            for search_ef in search_efs:
+                # The first value is applied at creation; others only if the segment can be reached
+                if not set_search_ef(collection, search_ef) and search_ef != search_efs[0]:
+                    print(f"Skipping search_ef={search_ef}: it could not be applied to the built index")
+                    continue
+                row = {
+                    'space': space, 'M': m, 'construction_ef': construction_ef, 'search_ef': search_ef,
+                    'build_seconds': build_seconds,
+                }
+                row.update(measure(collection, queries, exact_ids, k))
+                rows.append(row)
+                print(f"space={space} M={m} construction_ef={construction_ef} search_ef={search_ef}: "
+                      f"recall@{k}={row['recall_at_k']:.4f} p50={row['p50_ms']:.2f}ms "
+                      f"p95={row['p95_ms']:.2f}ms build={build_seconds:.1f}s")
+            chroma_client.delete_collection(f"hnsw_sweep_{n}")
+    return rows
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sweep HNSW parameters against exact search on a real collection")
+    parser.add_argument("--chroma-path", default="./chroma_last")
+    parser.add_argument("--collection", default="anime_clip_embeddings")
+    parser.add_argument("--snapshot", default=None, help="Reuse an existing vector_backend snapshot")
+    parser.add_argument("--spaces", nargs="+", default=["cosine"])
+    parser.add_argument("--m", nargs="+", type=int, default=[8, 16, 32])
+    parser.add_argument("--construction-ef", nargs="+", type=int, default=[100, 200])
+    parser.add_argument("--search-ef", nargs="+", type=int, default=[10, 50, 100, 200])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output", default=None, help="Write results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_dir = args.snapshot
+        if snapshot_dir is None:
+            # Exact ground truth comes from a NumPy snapshot of the real collection
+            collection = chromadb.PersistentClient(path=args.chroma_path).get_collection(args.collection)
+            export_snapshot(collection, tmp)
+            snapshot_dir = tmp
+        snapshot = NumpyBackend(snapshot_dir)
+        rows = sweep(snapshot, args.spaces, args.m, args.construction_ef, args.search_ef, args.k, args.queries)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=4)
+
+if __name__ == "__main__":
+    main()
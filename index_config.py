@@ -0,0 +1,82 @@
+from typing import Any, Dict, Optional
+
+# HNSW parameters every collection we create records. M and the two ef values are chromadb's
+# own defaults; cosine is this repo's choice (chromadb defaults to l2), so new collections get
+# a different space from one created with chromadb's defaults
+DEFAULT_SPACE = "cosine"
+DEFAULT_M = 16
+DEFAULT_CONSTRUCTION_EF = 100
+DEFAULT_SEARCH_EF = 10
+
+def hnsw_metadata(space: str = DEFAULT_SPACE,
+                  M: int = DEFAULT_M,
+                  construction_ef: int = DEFAULT_CONSTRUCTION_EF,
+                  search_ef: int = DEFAULT_SEARCH_EF,
+                  num_threads: Optional[int] = None) -> Dict[str, Any]:
+    """Collection metadata that pins the HNSW index parameters"""
+    if space not in ("l2", "cosine", "ip"):
+        raise ValueError(f"Unknown distance space: {space}")
+    metadata = {
+        "hnsw:space": space,
+        "hnsw:M": M,
+        "hnsw:construction_ef": construction_ef,
+        "hnsw:search_ef": search_ef,
+    }
+    if num_threads is not None:
+        metadata["hnsw:num_threads"] = num_threads
+    return metadata
+
+def collection_space(collection) -> str:
+    """Distance space of a collection; chromadb uses squared L2 when none was chosen"""
+    return (collection.metadata or {}).get("hnsw:space", "l2")
+
+def distance_to_similarity(distance: float, space: str) -> float:
+    """Cosine similarity of unit vectors from a Chroma distance in the given space"""
+    if space == "l2":
+        # Squared L2 between unit vectors is 2 - 2cos
+        return 1 - distance / 2
+    # "cosine" and "ip" distances are both 1 - dot product
+    return 1 - distance
+
+def similarity_to_distance(similarity, space: str):
+    """Inverse of distance_to_similarity; works on floats and NumPy arrays"""
+    if space == "l2":
+        return 2 - 2 * similarity
+    return 1 - similarity
+
+def set_search_ef(collection, search_ef: int) -> bool:
+    """Change search_ef on a collection's already-built HNSW index for this process
+
+    chromadb 0.4 copies hnsw:search_ef into the index segment when the collection is
+    created and ignores later metadata changes, so this reaches into the loaded segment.
+    Returns False if that isn't possible with the installed chromadb.
+    """
+    try:
+        from chromadb.segment import VectorReader
+
+        segment = collection._client._manager.get_segment(collection.id, VectorReader)
+        segment._params.search_ef = search_ef
+        if segment._index is not None:
+            segment._index.set_ef(search_ef)
+        return True
+    except Exception as e:
+        print(f"Could not set search_ef on {collection.name}: {e}")
+        return False
+
+def open_collection(chroma_client, name: str, metadata: Dict[str, Any]):
+    """Get a collection, creating it with the given HNSW metadata if it doesn't exist yet
+
+    Existing collections keep their parameters: chromadb can't rebuild an index in place,
+    and rewriting the metadata would make hnsw:space disagree with the actual index.
+    """
+    try:
+        collection = chroma_client.get_collection(name)
+    except ValueError:
+        return chroma_client.create_collection(name=name, metadata=metadata)
+
+    existing = collection.metadata or {}
+    differing = {key: existing.get(key) for key, value in metadata.items() if existing.get(key) != value}
+    if differing:
+        print(f"Collection {name} keeps its existing index settings {differing}; "
+              f"rebuild it into a new collection to apply {metadata}")
+    return collection
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import sqlite3
+import concurrent.futures
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from packed_store import PackedStore
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+class ManifestEntry(NamedTuple):
+    id: str
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    model: str
+
+class IngestPlan(NamedTuple):
+    to_embed: List[ManifestEntry]   # new or changed files
+    touched: List[ManifestEntry]    # same content, only size/mtime/path changed
+    removed: List[str]              # ids whose files are gone
+    unchanged: int
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash a file's content without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def scan_images(image_dir: str) -> List[Tuple[str, str, int, int]]:
+    """List image files as (id, path, size, mtime_ns) using a single scandir pass"""
+    files = []
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = entry.stat()
+                files.append((Path(entry.name).stem, entry.path, stat.st_size, stat.st_mtime_ns))
+    return files
+
+def scan_store(store: PackedStore) -> List[Tuple[str, str, int, int]]:
+    """Same as scan_images for a PackedStore, with keys in place of paths; nothing touches the disk"""
+    return [(Path(key).stem, key, entry.length, entry.mtime_ns)
+            for key, entry in store.items() if key.lower().endswith(IMAGE_EXTENSIONS)]
+
+class IngestManifest:
+    """SQLite record of which file content has been embedded under which id and model"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                model TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def entries(self) -> Dict[str, ManifestEntry]:
+        rows = self.conn.execute("SELECT id, path, size, mtime_ns, sha256, model FROM files")
+        return {row[0]: ManifestEntry(*row) for row in rows}
+
+    def record(self, entries: Iterable[ManifestEntry]):
+        """Mark entries as embedded; committed atomically so a crash never leaves a partial batch"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files (id, path, size, mtime_ns, sha256, model) VALUES (?, ?, ?, ?, ?, ?)",
+                [tuple(entry) for entry in entries]
+            )
+
+    def remove(self, ids: Iterable[str]):
+        with self.conn:
+            self.conn.executemany("DELETE FROM files WHERE id = ?", [(id_,) for id_ in ids])
+
+    def close(self):
+        self.conn.close()
+
+    def plan(self,
+             image_dir: str,
+             model_name: str,
+             force: bool = False,
+             hash_workers: int = 8,
+             image_store: Optional[PackedStore] = None) -> IngestPlan:
+        """Compare the image directory against the manifest and work out what needs embedding
+
+        force=True re-embeds every file that is still present. With image_store the store is
+        scanned instead of image_dir, entry paths are store keys and hashes come from its index.
+        """
+        known = self.entries()
+        scanned = scan_store(image_store) if image_store is not None else scan_images(image_dir)
+
+        unchanged = 0
+        candidates = []
+        for file_id, path, size, mtime_ns in scanned:
+            entry = known.get(file_id)
+            if (not force and entry is not None and entry.model == model_name and entry.path == path
+                    and entry.size == size and entry.mtime_ns == mtime_ns):
+                unchanged += 1
+            else:
+                candidates.append((file_id, path, size, mtime_ns))
+
+        # Only files whose stat changed are hashed
+        if image_store is not None:
+            hashes = [image_store.stat(c[1]).sha256 for c in candidates]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=hash_workers) as executor:
+                hashes = list(executor.map(file_sha256, [c[1] for c in candidates]))
+
+        to_embed, touched = [], []
+        for (file_id, path, size, mtime_ns), sha256 in zip(candidates, hashes):
+            new_entry = ManifestEntry(file_id, path, size, mtime_ns, sha256, model_name)
+            entry = known.get(file_id)
+            if not force and entry is not None and entry.model == model_name and entry.sha256 == sha256:
+                touched.append(new_entry)
+            else:
+                to_embed.append(new_entry)
+
+        scanned_ids = {file_id for file_id, _, _, _ in scanned}
+        removed = [file_id for file_id in known if file_id not in scanned_ids]
+        return IngestPlan(to_embed, touched, removed, unchanged)
@@ -0,0 +1,119 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Returned by EnrichmentCache.get when nothing (not even a negative entry) is cached
+MISS = object()
+
+def normalize_name(name: str) -> str:
+    """Cache key for a character name: no commas, collapsed whitespace, case-insensitive"""
+    return re.sub(r"\s+", " ", name.replace(',', ' ')).strip().lower()
+
+class EnrichmentCache:
+    """Jikan lookup cache with an in-process LRU tier in front of an optional SQLite tier
+
+    A cached value of None is a negative entry ("Jikan has no such character") and uses
+    its own, usually shorter, TTL.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = "./jikan_cache.sqlite3",
+                 max_entries: int = 10000,
+                 ttl: float = 7 * 24 * 3600,
+                 negative_ttl: float = 6 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'negative_hits': 0, 'misses': 0, 'expired': 0}
+
+        self._conn = None
+        if path:
+            # Shared across Flask worker threads, guarded by self._lock
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jikan_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+
+    def get(self, name: str) -> Any:
+        """Return the cached dict, None for a negative entry, or MISS"""
+        key = normalize_name(name)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._count_hit('memory_hits', value)
+                    return value
+                del self._memory[key]
+                self._stats['expired'] += 1
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM jikan_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        value = json.loads(row[0]) if row[0] is not None else None
+                        self._remember(key, value, row[1])
+                        self._count_hit('disk_hits', value)
+                        return value
+                    self._stats['expired'] += 1
+
+            self._stats['misses'] += 1
+            return MISS
+
+    def set(self, name: str, value: Optional[Dict[str, Any]]):
+        """Store a lookup result; pass None to record that the character was not found"""
+        key = normalize_name(name)
+        expires_at = time.time() + (self.ttl if value is not None else self.negative_ttl)
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO jikan_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value) if value is not None else None, expires_at)
+                    )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def purge_expired(self):
+        """Drop expired rows from the on-disk tier"""
+        if self._conn is not None:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM jikan_cache WHERE expires_at <= ?", (time.time(),))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _remember(self, key: str, value: Optional[Dict[str, Any]], expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _count_hit(self, tier: str, value: Optional[Dict[str, Any]]):
+        self._stats[tier] += 1
+        if value is None:
+            self._stats['negative_hits'] += 1
@@ -0,0 +1,245 @@
+import asyncio
+import collections
+import concurrent.futures
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import aiohttp
+
+from jikan_cache import EnrichmentCache, MISS, normalize_name
+from metrics import CACHE_LOOKUPS
+
+JIKAN_CHARACTERS_URL = "https://api.jikan.moe/v4/characters"
+
+def parse_jikan_character(data: Dict[str, Any]) -> Optional[dict]:
+    """Pick the fields we show from a Jikan /characters search response"""
+    if data.get('data') and len(data['data']) > 0:
+        return {
+            'mal_id': data['data'][0]['mal_id'],
+            'url': data['data'][0]['url'],
+            'image_url': data['data'][0]['images']['jpg']['image_url'],
+            'name': data['data'][0]['name']
+        }
+    return None
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out reservations, so callers queue up fairly"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, not_before: float = 0.0) -> float:
+        """Take one token and return how long the caller must wait before using it
+
+        not_before is ignored: a bucket only gets stricter if a token is used later than booked.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Going negative books a future slot instead of making callers poll
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+class SlidingWindow:
+    """At most `limit` requests in any `period` seconds, booked as reservations like TokenBucket
+
+    Unlike a bucket it allows a full burst of `limit` without letting more through in the
+    following period, so the burst itself is only paced by the other limits.
+    """
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        # Times of the last `limit` reservations, oldest first
+        self._slots: collections.deque = collections.deque(maxlen=limit)
+        self._lock = threading.Lock()
+
+    def reserve(self, not_before: float = 0.0) -> float:
+        """Book the earliest slot at or after not_before (a time.monotonic() value); returns the wait"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, not_before)
+            if len(self._slots) == self.limit:
+                slot = max(slot, self._slots[0] + self.period)
+            self._slots.append(slot)
+            return slot - now
+
+class RateLimiter:
+    """Several limits that must all allow a request (e.g. per second and per minute)"""
+
+    def __init__(self, buckets: List[Union[TokenBucket, SlidingWindow]]):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # Each limit books no earlier than the ones before it allow, so a window listed last
+        # records when requests really go out
+        with self._lock:
+            wait = 0.0
+            for bucket in self.buckets:
+                wait = max(wait, bucket.reserve(time.monotonic() + wait))
+            return wait
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+    async def acquire_async(self):
+        await asyncio.sleep(self.reserve())
+
+# Jikan allows 3 requests/second and 60 requests/minute per client; shared by the whole process.
+# The minute limit is a sliding window rather than a bucket: a bucket full at 60 tokens would let
+# ~120 through in the first minute, while the window lets bursts run at 3/s up to 60 per minute
+JIKAN_LIMITER = RateLimiter([TokenBucket(rate=3, capacity=3), SlidingWindow(limit=60, period=60)])
+
+class JikanClient:
+    """Jikan character lookups over one pooled aiohttp session
+
+    The session lives on a private event loop thread, so the same connection pool and
+    rate limiter serve both synchronous callers (Flask) and coroutines on other loops.
+    """
+
+    def __init__(self,
+                 cache: Optional[EnrichmentCache] = None,
+                 limiter: RateLimiter = JIKAN_LIMITER,
+                 base_url: str = JIKAN_CHARACTERS_URL,
+                 max_connections: int = 10,
+                 max_retries: int = 4,
+                 timeout: float = 10.0):
+        self.cache = cache
+        self.limiter = limiter
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="jikan-client", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def _fetch(self, character_name: str) -> Optional[dict]:
+        if self.cache is not None:
+            cached = self.cache.get(character_name)
+            CACHE_LOOKUPS.inc(cache="enrichment", result="miss" if cached is MISS else "hit")
+            if cached is not MISS:
+                return cached
+
+        search_name = character_name.replace(',', '').strip()
+        session = await self._get_session()
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire_async()
+            try:
+                async with session.get(self.base_url, params={'q': search_name, 'limit': 1}) as response:
+                    if response.status == 200:
+                        try:
+                            jikan_data = parse_jikan_character(await response.json())
+                        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                            # Not cached, and only this name goes without enrichment
+                            print(f"Unexpected Jikan response for {search_name}: {e!r}")
+                            return None
+                        # A definite "not found" is cached too; errors and 429s are not
+                        if self.cache is not None:
+                            self.cache.set(character_name, jikan_data)
+                        return jikan_data
+                    if response.status != 429 and response.status < 500:
+                        print(f"Jikan returned {response.status} for {search_name}")
+                        return None
+                    retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error fetching Jikan data for {search_name}: {e}")
+                retry_after = None
+
+            if attempt < self.max_retries:
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else 0.5 * 2 ** attempt
+                await asyncio.sleep(delay + random.uniform(0, 0.25))
+        return None
+
+    async def _fetch_many(self, names: List[str]) -> Dict[str, Optional[dict]]:
+        # Names that normalize to the same key are looked up once
+        unique = {}
+        for name in names:
+            unique.setdefault(normalize_name(name), name)
+        values = await asyncio.gather(*(self._fetch(name) for name in unique.values()))
+        by_key = dict(zip(unique.keys(), values))
+        return {name: by_key[normalize_name(name)] for name in names}
+
+    def fetch_many(self, names: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """Look up all names concurrently (within the rate limit); blocks until done"""
+        names = list(names)
+        if not names:
+            return {}
+        future = asyncio.run_coroutine_threadsafe(self._fetch_many(names), self._ensure_loop())
+        return future.result()
+
+    async def fetch_many_async(self, names: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """Awaitable version of fetch_many, usable from any event loop"""
+        names = list(names)
+        if not names:
+            return {}
+        future = asyncio.run_coroutine_threadsafe(self._fetch_many(names), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    def _submit_each(self, names: Iterable[str]) -> Dict[concurrent.futures.Future, List[str]]:
+        """Start one lookup per normalized name; maps each future to the distinct names it answers"""
+        groups: Dict[str, List[str]] = {}
+        for name in dict.fromkeys(names):
+            groups.setdefault(normalize_name(name), []).append(name)
+        loop = self._ensure_loop()
+        return {asyncio.run_coroutine_threadsafe(self._fetch(group[0]), loop): group for group in groups.values()}
+
+    def fetch_as_completed(self, names: Iterable[str]) -> Iterator[Tuple[str, Optional[dict]]]:
+        """Yield (name, jikan_data) for each distinct name as soon as its lookup finishes"""
+        futures = self._submit_each(names)
+        for future in concurrent.futures.as_completed(futures):
+            for name in futures[future]:
+                yield name, future.result()
+
+    async def fetch_as_completed_async(self, names: Iterable[str]) -> AsyncIterator[Tuple[str, Optional[dict]]]:
+        """Async generator version of fetch_as_completed, usable from any event loop"""
+        futures = {asyncio.wrap_future(future): group for future, group in self._submit_each(names).items()}
+        pending = set(futures)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                for name in futures[future]:
+                    yield name, future.result()
+
+    def fetch(self, character_name: str) -> Optional[dict]:
+        return self.fetch_many([character_name])[character_name]
+
+    async def fetch_async(self, character_name: str) -> Optional[dict]:
+        return (await self.fetch_many_async([character_name]))[character_name]
+
+    def close(self):
+        """Close the pooled session and stop the client's event loop"""
+        if self._loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
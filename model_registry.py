@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import torch
+from transformers import CLIPConfig, CLIPModel, CLIPProcessor
+
+from encoder_backends import load_encoder
+
+DEFAULT_MODEL = "openai/clip-vit-large-patch14-336"
+
+# Collection metadata keys describing the embeddings, next to chromadb's own hnsw:* keys
+MODEL_KEY = "embedding:model"
+DIM_KEY = "embedding:dim"
+NORMALIZATION_KEY = "embedding:normalization"
+PREPROCESSING_KEY = "embedding:preprocessing"
+EMBEDDING_KEYS = (MODEL_KEY, DIM_KEY, NORMALIZATION_KEY, PREPROCESSING_KEY)
+
+def preprocessing_signature(processor: CLIPProcessor) -> str:
+    """The image processor settings that decide what pixels a model sees, as a compact JSON string"""
+    image_processor = processor.image_processor
+    settings = {name: getattr(image_processor, name, None) for name in (
+        "do_resize", "size", "resample", "do_center_crop", "crop_size", "do_rescale", "rescale_factor",
+        "do_normalize", "image_mean", "image_std", "do_convert_rgb",
+    )}
+    return json.dumps(settings, sort_keys=True, separators=(",", ":"), default=str)
+
+def embedding_metadata(model_name: str, dim: int, processor: CLIPProcessor) -> Dict[str, Any]:
+    """Collection metadata recording how its embeddings were made
+
+    Ingestion always stores L2-normalized vectors (see anime_clip_processor.embed_batch).
+    """
+    return {
+        MODEL_KEY: model_name,
+        DIM_KEY: int(dim),
+        NORMALIZATION_KEY: "l2",
+        PREPROCESSING_KEY: preprocessing_signature(processor),
+    }
+
+def checkpoint_metadata(model_name: str, processor: Optional[CLIPProcessor] = None) -> Dict[str, Any]:
+    """embedding_metadata for a checkpoint without loading its weights"""
+    if processor is None:
+        processor = CLIPProcessor.from_pretrained(model_name)
+    return embedding_metadata(model_name, CLIPConfig.from_pretrained(model_name).projection_dim, processor)
+
+def recorded_model(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The embedding:* entries of a collection's metadata; empty for collections that predate them"""
+    return {key: value for key, value in (metadata or {}).items() if key in EMBEDDING_KEYS}
+
+def check_model(metadata: Optional[Dict[str, Any]], expected: Dict[str, Any], name: str = "collection") -> List[str]:
+    """Raise ValueError if a collection was built with another model or dimension
+
+    Returns warnings for differences that still give usable results, like preprocessing.
+    """
+    recorded = recorded_model(metadata)
+    for key in (MODEL_KEY, DIM_KEY):
+        if key in recorded and recorded[key] != expected[key]:
+            raise ValueError(f"{name} holds embeddings with {key}={recorded[key]!r}, "
+                             f"but {expected[MODEL_KEY]} gives {key}={expected[key]!r}")
+    warnings = []
+    for key in (NORMALIZATION_KEY, PREPROCESSING_KEY):
+        if key in recorded and recorded[key] != expected[key]:
+            warnings.append(f"{name} was built with {key}={recorded[key]}, queries use {expected[key]}")
+    return warnings
+
+def pin_collection_model(collection, expected: Dict[str, Any]):
+    """Check a collection against the model about to write to it, recording the model if it has none yet"""
+    for warning in check_model(collection.metadata, expected, f"Collection {collection.name}"):
+        print(warning)
+    if recorded_model(collection.metadata) != expected:
+        collection.modify(metadata={**(collection.metadata or {}), **expected})
+
+class LoadedModel(NamedTuple):
+    model_name: str
+    processor: CLIPProcessor
+    encoder: Any
+    model: Optional[CLIPModel]      # None for exported encoders
+    dim: int
+    # Fast tokenizers must not be called from two threads at once
+    lock: threading.Lock
+
+class ModelRegistry:
+    """Loads each (model, encoder backend) once and hands the same instance to every index using it"""
+
+    def __init__(self, device: Optional[str] = None):
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self._models: Dict[Tuple[str, str, Optional[str]], LoadedModel] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str, encoder_backend: str = "torch", encoder_dir: Optional[str] = None) -> LoadedModel:
+        key = (model_name, encoder_backend, encoder_dir)
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = self._load(model_name, encoder_backend, encoder_dir)
+            return self._models[key]
+
+    def _load(self, model_name: str, encoder_backend: str, encoder_dir: Optional[str]) -> LoadedModel:
+        print(f"Loading {model_name} ({encoder_backend}) on {self.device}")
+        if encoder_backend in ("torch", "torch-int8"):
+            # torch-int8 runs the Linear layers of both towers as dynamic int8 on CPU
+            processor = CLIPProcessor.from_pretrained(model_name)
+            encoder = load_encoder(encoder_backend, model_name, device=self.device)
+            model = encoder.model
+            dim = model.config.projection_dim
+        else:
+            # Exported towers (see encoder_backends.export_encoders) replace CLIPModel entirely
+            processor = CLIPProcessor.from_pretrained(encoder_dir)
+            encoder = load_encoder(encoder_backend, model_name, encoder_dir)
+            model = None
+            with open(os.path.join(encoder_dir, "encoder.json")) as f:
+                dim = json.load(f)['dim']
+        return LoadedModel(model_name, processor, encoder, model, dim, threading.Lock())
+
+    def loaded(self) -> List[Tuple[str, str, Optional[str]]]:
+        with self._lock:
+            return list(self._models)
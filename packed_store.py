@@ -0,0 +1,192 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+INDEX_FILE = "index.tsv"
+DEFAULT_SHARD_SIZE = 1 << 30
+
+class BlobEntry(NamedTuple):
+    shard: int
+    offset: int
+    length: int
+    mtime_ns: int
+    sha256: str
+
+def _shard_name(shard: int) -> str:
+    return f"shard-{shard:05d}.pack"
+
+class PackedStore:
+    """Many small files packed into sharded append-only blobs with a TSV offset index
+
+    Each put appends the bytes to the current shard and then one
+    key/shard/offset/length/mtime_ns/sha256 line to index.tsv; a later line for the same
+    key wins and a length of -1 deletes it. Blob data is always written before its index
+    line, so readers in other processes can pick up new entries with refresh() at any time.
+    Reads go through a read-only mmap of each shard. Only one process may write at a time.
+    """
+
+    def __init__(self, root: str, readonly: bool = False, shard_size: int = DEFAULT_SHARD_SIZE):
+        self.root = root
+        self.readonly = readonly
+        self.shard_size = shard_size
+        self._entries: Dict[str, BlobEntry] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._index_pos = 0
+        self._lock = threading.Lock()
+        if not readonly:
+            os.makedirs(root, exist_ok=True)
+        self.refresh()
+
+        self._index = None
+        self._shard = None
+        if not readonly:
+            index_path = os.path.join(root, INDEX_FILE)
+            if os.path.exists(index_path) and os.path.getsize(index_path) > self._index_pos:
+                # Drop a line left half-written by a crashed writer
+                os.truncate(index_path, self._index_pos)
+            self._index = open(index_path, "a", encoding="utf-8")
+            last = max((entry.shard for entry in self._entries.values()), default=0)
+            self._open_shard(last)
+
+    @staticmethod
+    def is_store(path: str) -> bool:
+        return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+    def refresh(self):
+        """Read index lines appended since the last call (e.g. by an ingestion run)"""
+        index_path = os.path.join(self.root, INDEX_FILE)
+        with self._lock:
+            try:
+                if os.path.getsize(index_path) == self._index_pos:
+                    return
+                with open(index_path, "rb") as f:
+                    f.seek(self._index_pos)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            # A writer is mid-line; pick it up next time
+                            break
+                        self._index_pos += len(line)
+                        fields = line.decode("utf-8").rstrip("\n").split("\t")
+                        if len(fields) != 6:
+                            print(f"Skipping malformed index line in {self.root}: {line!r}")
+                            continue
+                        key, shard, offset, length, mtime_ns, sha256 = fields
+                        if int(length) < 0:
+                            self._entries.pop(key, None)
+                        else:
+                            self._entries[key] = BlobEntry(int(shard), int(offset), int(length), int(mtime_ns), sha256)
+            except FileNotFoundError:
+                pass
+
+    def _open_shard(self, shard: int):
+        if self._shard is not None:
+            self._shard.close()
+        self._shard_id = shard
+        self._shard = open(os.path.join(self.root, _shard_name(shard)), "ab")
+
+    def put(self, key: str, data: bytes, mtime_ns: Optional[int] = None) -> BlobEntry:
+        """Append one blob; replaces any earlier blob with the same key"""
+        if self.readonly:
+            raise ValueError(f"{self.root} is open read-only")
+        if not key or "\t" in key or "\n" in key:
+            raise ValueError(f"Invalid key: {key!r}")
+        with self._lock:
+            if self._shard.tell() > 0 and self._shard.tell() + len(data) > self.shard_size:
+                self._open_shard(self._shard_id + 1)
+            offset = self._shard.tell()
+            self._shard.write(data)
+            self._shard.flush()
+            entry = BlobEntry(self._shard_id, offset, len(data), mtime_ns or time.time_ns(),
+                              hashlib.sha256(data).hexdigest())
+            self._write_index(key, entry)
+            self._entries[key] = entry
+            return entry
+
+    def delete(self, key: str):
+        if self.readonly:
+            raise ValueError(f"{self.root} is open read-only")
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._write_index(key, BlobEntry(0, 0, -1, time.time_ns(), ""))
+
+    def _write_index(self, key: str, entry: BlobEntry):
+        line = f"{key}\t{entry.shard}\t{entry.offset}\t{entry.length}\t{entry.mtime_ns}\t{entry.sha256}\n"
+        self._index.write(line)
+        self._index.flush()
+        self._index_pos += len(line.encode("utf-8"))
+
+    def stat(self, key: str) -> Optional[BlobEntry]:
+        return self._entries.get(key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.length == 0:
+            return b""
+        with self._lock:
+            data = self._maps.get(entry.shard)
+            if data is None or entry.offset + entry.length > len(data):
+                # First read of this shard, or it has grown since it was mapped
+                if data is not None:
+                    data.close()
+                with open(os.path.join(self.root, _shard_name(entry.shard)), "rb") as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[entry.shard] = data
+            return data[entry.offset:entry.offset + entry.length]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def keys(self) -> List[str]:
+        return list(self._entries)
+
+    def items(self) -> Iterator[Tuple[str, BlobEntry]]:
+        return iter(list(self._entries.items()))
+
+    def close(self):
+        with self._lock:
+            for data in self._maps.values():
+                data.close()
+            self._maps.clear()
+            if self._shard is not None:
+                self._shard.close()
+                self._index.close()
+                self._shard = self._index = None
+
+def pack_directory(src_dir: str, store: PackedStore, extensions: Optional[Tuple[str, ...]] = None) -> int:
+    """Copy every file of a directory into a store, keeping names and mtimes; returns the number copied"""
+    copied = 0
+    with os.scandir(src_dir) as it:
+        for entry in sorted(it, key=lambda e: e.name):
+            if not entry.is_file() or (extensions and not entry.name.lower().endswith(extensions)):
+                continue
+            stat = entry.stat()
+            existing = store.stat(entry.name)
+            if existing is not None and existing.length == stat.st_size and existing.mtime_ns == stat.st_mtime_ns:
+                continue
+            with open(entry.path, "rb") as f:
+                store.put(entry.name, f.read(), mtime_ns=stat.st_mtime_ns)
+            copied += 1
+    return copied
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate an image or thumbnail directory into a packed store")
+    parser.add_argument("src_dir", help="e.g. ./images or ./thumbnails")
+    parser.add_argument("store", help="Store directory to create or extend, e.g. ./images.pack")
+    parser.add_argument("--shard-size-mb", type=int, default=DEFAULT_SHARD_SIZE >> 20)
+    args = parser.parse_args()
+
+    store = PackedStore(args.store, shard_size=args.shard_size_mb << 20)
+    start = time.perf_counter()
+    copied = pack_directory(args.src_dir, store)
+    print(f"Packed {copied} files into {args.store} ({len(store)} total) in {time.perf_counter() - start:.1f}s")
+    store.close()
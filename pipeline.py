@@ -0,0 +1,274 @@
+import asyncio
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import chromadb
+from transformers import CLIPModel, CLIPProcessor
+
+from anime_clip_processor import _init_worker, device, preprocess_bytes, upsert_batch
+from crawler import JIKAN_API_BASE, Crawler, CrawlState
+from index_config import hnsw_metadata, open_collection
+from ingest_manifest import IngestManifest, ManifestEntry
+from model_registry import embedding_metadata, pin_collection_model
+from packed_store import PackedStore
+
+def put_while_alive(images: "queue.Queue[Optional[Tuple[str, bytes]]]", item, indexer: threading.Thread,
+                    poll: float = 1.0):
+    """queue.put that raises instead of blocking forever on a full queue nobody drains any more"""
+    while True:
+        try:
+            images.put(item, timeout=poll)
+            return
+        except queue.Full:
+            if not indexer.is_alive():
+                raise RuntimeError("The indexer thread has stopped")
+
+class PipelineSink:
+    """Crawler sink that hands image bytes to the indexer instead of only writing them out
+
+    The indexer, not the crawler, marks each character done, failed or undecodable in the
+    crawl state once its batch is upserted, so images that never make it into the index are
+    retried by the next run. With archive_store or archive_dir the raw bytes are also kept, so a later
+    anime_clip_processor run can re-embed them from there.
+    """
+
+    def __init__(self, images: "queue.Queue[Optional[Tuple[str, bytes]]]",
+                 indexer: threading.Thread,
+                 archive_store: Optional[PackedStore] = None,
+                 archive_dir: Optional[str] = None):
+        self.images = images
+        self.indexer = indexer
+        self.archive_store = archive_store
+        self.archive_dir = archive_dir
+        if archive_dir:
+            os.makedirs(archive_dir, exist_ok=True)
+
+    async def write(self, file_name: str, response) -> bool:
+        data = await response.read()
+        if self.archive_store is not None:
+            self.archive_store.put(file_name, data)
+        elif self.archive_dir:
+            path = os.path.join(self.archive_dir, file_name)
+            with open(f"{path}.part", "wb") as f:
+                f.write(data)
+            os.replace(f"{path}.part", path)
+        # Waits (off the event loop) while the indexer is behind; this is the backpressure
+        await asyncio.get_running_loop().run_in_executor(None, put_while_alive, self.images, (file_name, data), self.indexer)
+        # The indexer records the outcome
+        return True
+
+class Indexer(threading.Thread):
+    """Drains (file name, bytes) from a bounded queue into the collection in batches
+
+    A batch is flushed when it is full or max_wait seconds after its first image, so a
+    slow trickle of new characters is still searchable quickly. Decoding and preprocessing
+    run in a process pool; the forward pass and upsert run here. With state_path, every image
+    is marked done, failed (retried by the next crawl) or undecodable in the crawl state once
+    its batch has been tried.
+    """
+
+    def __init__(self,
+                 images: "queue.Queue[Optional[Tuple[str, bytes]]]",
+                 collection,
+                 model: CLIPModel,
+                 processor: CLIPProcessor,
+                 model_name: str,
+                 batch_size: int = 32,
+                 num_workers: Optional[int] = None,
+                 max_wait: float = 2.0,
+                 manifest_path: Optional[str] = None,
+                 state_path: Optional[str] = None,
+                 archive_store: Optional[PackedStore] = None,
+                 archive_dir: Optional[str] = None):
+        super().__init__(name="pipeline-indexer", daemon=True)
+        self.images = images
+        self.collection = collection
+        self.model = model
+        self.processor = processor
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_workers = num_workers if num_workers is not None else max(1, (os.cpu_count() or 2) - 1)
+        self.max_wait = max_wait
+        self.manifest_path = manifest_path
+        self.state_path = state_path
+        self.archive_store = archive_store
+        self.archive_dir = archive_dir
+        self.indexed = 0
+        self.failed = 0
+
+    def _batches(self):
+        while True:
+            item = self.images.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.images.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    yield batch
+                    return
+                batch.append(item)
+            yield batch
+
+    def _manifest_entries(self, batch: List[Tuple[str, bytes]], file_ids: List[str]) -> List[ManifestEntry]:
+        """What anime_clip_processor would record for the archived copies, so it won't re-embed them"""
+        by_id = {Path(file_name).stem: (file_name, data) for file_name, data in batch}
+        entries = []
+        for file_id in file_ids:
+            file_name, data = by_id[file_id]
+            if self.archive_store is not None:
+                blob = self.archive_store.stat(file_name)
+                entries.append(ManifestEntry(file_id, file_name, blob.length, blob.mtime_ns, blob.sha256, self.model_name))
+            else:
+                path = os.path.join(self.archive_dir, file_name)
+                stat = os.stat(path)
+                entries.append(ManifestEntry(file_id, path, stat.st_size, stat.st_mtime_ns,
+                                             hashlib.sha256(data).hexdigest(), self.model_name))
+        return entries
+
+    def _executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.num_workers, initializer=_init_worker, initargs=(self.processor,)
+        )
+
+    def run(self):
+        # SQLite connections belong to the thread that opened them
+        state = CrawlState(self.state_path) if self.state_path else None
+        manifest = None
+        if self.manifest_path and (self.archive_store is not None or self.archive_dir):
+            manifest = IngestManifest(self.manifest_path)
+        executor = self._executor()
+        try:
+            for batch in self._batches():
+                file_ids = []
+                undecodable = []
+                try:
+                    results = list(executor.map(preprocess_bytes, batch, chunksize=max(1, len(batch) // 8)))
+                    undecodable = [file_name for (file_name, _), r in zip(batch, results) if r is None]
+                    batch_data = [r for r in results if r]
+                    if batch_data:
+                        file_ids = upsert_batch(batch_data, self.collection, self.model, device)
+                        print(f"Indexed {len(file_ids)} images (total {self.indexed + len(file_ids)})")
+                        if manifest is not None:
+                            manifest.record(self._manifest_entries(batch, file_ids))
+                except BrokenProcessPool as e:
+                    # A worker died (e.g. killed for memory); start a fresh pool for the next batch
+                    print(f"Error preprocessing batch: {str(e)}")
+                    executor.shutdown(wait=False)
+                    executor = self._executor()
+                except Exception as e:
+                    print(f"Error adding batch to ChromaDB: {str(e)}")
+
+                indexed = set(file_ids)
+                done = [file_name for file_name, _ in batch if Path(file_name).stem in indexed]
+                # Only batch-level errors are worth retrying; an image that won't decode never will
+                failed = [file_name for file_name, _ in batch
+                          if Path(file_name).stem not in indexed and file_name not in undecodable]
+                self.indexed += len(done)
+                self.failed += len(failed) + len(undecodable)
+                if state is not None:
+                    state.record_files(done, "done")
+                    state.record_files(failed, "failed")
+                    state.record_files(undecodable, "undecodable")
+        finally:
+            executor.shutdown()
+            if manifest is not None:
+                manifest.close()
+            if state is not None:
+                state.close()
+
+def run_pipeline(anime_ids: Iterable[int],
+                 model_name: str = "cyborgpunk/anime_2",
+                 chroma_path: str = "./chroma_db",
+                 state_path: str = "./crawl_state.sqlite3",
+                 archive_store: Optional[str] = None,
+                 archive_dir: Optional[str] = None,
+                 batch_size: int = 32,
+                 num_workers: Optional[int] = None,
+                 queue_size: int = 256,
+                 max_wait: float = 2.0,
+                 index_metadata: Optional[dict] = None,
+                 **crawler_options) -> dict:
+    """Crawl anime ids and embed every new character image as it arrives, in one pass
+
+    At most queue_size images sit between the crawler and the indexer. A character is only
+    marked done in the crawl state once its image is in the collection, so images lost to a
+    crash or a failed batch are downloaded again by the next run.
+    """
+    model = CLIPModel.from_pretrained(model_name).to(device).eval()
+    processor = CLIPProcessor.from_pretrained(model_name, use_fast=True)
+    chroma_client = chromadb.PersistentClient(path=chroma_path)
+    collection = open_collection(chroma_client, "anime_clip_embeddings", index_metadata or hnsw_metadata())
+    pin_collection_model(collection, embedding_metadata(model_name, model.config.projection_dim, processor))
+
+    images: "queue.Queue[Optional[Tuple[str, bytes]]]" = queue.Queue(maxsize=queue_size)
+    store = PackedStore(archive_store) if archive_store else None
+    # Creates the crawl state tables before the indexer opens its own connection
+    state = CrawlState(state_path)
+    indexer = Indexer(images, collection, model, processor, model_name, batch_size, num_workers, max_wait,
+                      manifest_path=os.path.join(chroma_path, "ingest_manifest.sqlite3"), state_path=state_path,
+                      archive_store=store, archive_dir=archive_dir)
+    indexer.start()
+
+    async def crawl() -> dict:
+        sink = PipelineSink(images, indexer, archive_store=store, archive_dir=archive_dir)
+        task = asyncio.ensure_future(Crawler(state, sink, **crawler_options).run(anime_ids))
+        # Stop crawling if the indexer dies, rather than downloading images nothing will index
+        while not task.done():
+            await asyncio.wait([task], timeout=1.0)
+            if not indexer.is_alive() and not task.done():
+                task.cancel()
+                raise RuntimeError("The indexer thread has stopped; crawl aborted")
+        return task.result()
+
+    start = time.perf_counter()
+    try:
+        counts = asyncio.run(crawl())
+    finally:
+        if indexer.is_alive():
+            put_while_alive(images, None, indexer)
+        indexer.join()
+        state.close()
+        if store is not None:
+            store.close()
+
+    elapsed = time.perf_counter() - start
+    counts.update(indexed=indexer.indexed, index_failed=indexer.failed)
+    print(f"\nPipeline finished in {elapsed:.1f}s: {counts} "
+          f"({indexer.indexed / elapsed if elapsed else 0.0:.1f} images/s indexed); "
+          f"collection count: {collection.count()}")
+    return counts
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Crawl character images and index them into ChromaDB in one pass")
+    parser.add_argument("--start", type=int, default=20000)
+    parser.add_argument("--end", type=int, default=30000)
+    parser.add_argument("--model", default="cyborgpunk/anime_2")
+    parser.add_argument("--chroma-path", default="./chroma_db")
+    parser.add_argument("--state", default="./crawl_state.sqlite3")
+    parser.add_argument("--archive-store", default=None, help="Also append raw images to this PackedStore")
+    parser.add_argument("--archive-dir", default=None, help="Also write raw images to this directory")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--max-wait", type=float, default=2.0, help="Seconds before a partial batch is indexed")
+    parser.add_argument("--api-base", default=JIKAN_API_BASE)
+    args = parser.parse_args()
+
+    run_pipeline(range(args.start, args.end), model_name=args.model, chroma_path=args.chroma_path,
+                 state_path=args.state, archive_store=args.archive_store, archive_dir=args.archive_dir,
+                 batch_size=args.batch_size, num_workers=args.workers, queue_size=args.queue_size,
+                 max_wait=args.max_wait, api_base=args.api_base)
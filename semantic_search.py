@@ -1,74 +1,236 @@
-import aiohttp
 import asyncio
 from typing import Dict, Any , List , Tuple, Optional
-from transformers import CLIPProcessor, CLIPModel
-import torch
 import chromadb
 import numpy as np
 from PIL import Image
 import io
+import time
+from embedding_cache import EmbeddingCache, content_hash, dhash, normalize_query
+from jikan_cache import EnrichmentCache
+from jikan_client import JikanClient
+from metrics import CACHE_LOOKUPS, timed_stage
+from model_registry import DEFAULT_MODEL, MODEL_KEY, ModelRegistry, check_model, embedding_metadata, recorded_model
+from index_config import collection_space, distance_to_similarity, set_search_ef
+from vector_backend import ChromaBackend, NumpyBackend, chroma_fingerprint
 
 class AnimeImageSearch:
-    def __init__(self, model_name: str = "openai/clip-vit-large-patch14-336"):
-        # Initialize device (CUDA if available, else CPU)
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self,
+                 model_name: Optional[str] = None,
+                 enrichment_cache: Optional[EnrichmentCache] = None,
+                 jikan_client: Optional[JikanClient] = None,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 perceptual_hash: bool = False,
+                 encode_batch_size: int = 32,
+                 chroma_path: Optional[str] = "./chroma_last",
+                 collection_name: str = "anime_clip_embeddings",
+                 snapshot_dir: Optional[str] = None,
+                 snapshot_dtype: str = "float32",
+                 staleness_check_interval: float = 30.0,
+                 search_ef: Optional[int] = None,
+                 encoder_backend: str = "torch",
+                 encoder_dir: Optional[str] = None,
+                 registry: Optional[ModelRegistry] = None):
+        self.chroma_path = chroma_path
+        # Largest batch sent through either tower in one forward pass
+        self.encode_batch_size = encode_batch_size
+        # Also match image queries by a perceptual hash of the decoded pixels, not just their bytes
+        self.perceptual_hash = perceptual_hash
+        # Cache for Jikan lookups; anything with the same get/set interface can be plugged in
+        self.enrichment_cache = enrichment_cache if enrichment_cache is not None else EnrichmentCache()
+        # One pooled, rate-limited client shared by every lookup this searcher makes
+        self.jikan = jikan_client if jikan_client is not None else JikanClient(cache=self.enrichment_cache)
+        # Query embeddings for repeated searches; pass one with a path to keep it across restarts
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache()
+        # Several searchers over different indexes can share one registry, and so one copy of each model
+        registry = registry if registry is not None else ModelRegistry()
+        self.device = registry.device
         print(f"Using device: {self.device}")
-        
+
         try:
-            # Load CLIP model and processor
-            self.model = CLIPModel.from_pretrained(model_name).to(self.device)
-            self.processor = CLIPProcessor.from_pretrained(model_name)
-            self.model.eval()
-            
-            # Initialize ChromaDB
-            self.chroma_client = chromadb.PersistentClient(path="./chroma_last")
-            self.collection = self.chroma_client.get_collection("anime_clip_embeddings")
-            print(f"Successfully loaded collection with {self.collection.count()} entries")
+            self.staleness_check_interval = staleness_check_interval
+            self._last_staleness_check = float("-inf")
+            self._snapshot_stale = False
+
+            if chroma_path is None:
+                # Read-only serving straight from a snapshot: no Chroma client, nothing to open or count
+                if not snapshot_dir:
+                    raise ValueError("A snapshot_dir is required when chroma_path is None")
+                self.chroma_client = self.collection = self.chroma_backend = None
+                self.snapshot_backend = NumpyBackend(snapshot_dir, dtype=snapshot_dtype)
+                self.space = self.snapshot_backend.space
+                self.index_metadata = self.snapshot_backend.manifest.get('collection_metadata') or {}
+                print(f"Serving {self.snapshot_backend.count()} entries read-only from snapshot {snapshot_dir}")
+            else:
+                # Initialize ChromaDB
+                self.chroma_client = chromadb.PersistentClient(path=chroma_path)
+                self.collection = self.chroma_client.get_collection(collection_name)
+                self.index_metadata = self.collection.metadata or {}
+                print(f"Successfully loaded collection with {self.collection.count()} entries")
+
+                # Distances are converted to similarities according to the collection's own space
+                self.space = collection_space(self.collection)
+                if search_ef is not None:
+                    set_search_ef(self.collection, search_ef)
+
+                # Optional exact-search snapshot; Chroma answers whenever it is out of date
+                self.chroma_backend = ChromaBackend(self.collection)
+                # snapshot_dtype "float16"/"int8" scans a compact copy and reranks with float32 rows
+                self.snapshot_backend = NumpyBackend(snapshot_dir, dtype=snapshot_dtype, space=self.space) if snapshot_dir else None
+
+            # Without an explicit model, use the one the index records having been built with
+            self.model_name = model_name or recorded_model(self.index_metadata).get(MODEL_KEY, DEFAULT_MODEL)
+            # int8 embeddings differ slightly from float ones, so they get their own cache entries
+            self.embedding_model_id = f"{self.model_name}#int8" if encoder_backend == "torch-int8" else self.model_name
+
+            loaded = registry.get(self.model_name, encoder_backend, encoder_dir)
+            self.processor = loaded.processor
+            self.encoder = loaded.encoder
+            self.model = loaded.model
+            self._tokenizer_lock = loaded.lock
+            for warning in check_model(self.index_metadata, embedding_metadata(self.model_name, loaded.dim, self.processor),
+                                       f"Index {chroma_path or snapshot_dir}"):
+                print(warning)
         except Exception as e:
             raise RuntimeError(f"Failed to initialize search: {e}")
 
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Encode many text queries; cache misses go through the text tower in padded batches"""
+        keys = [normalize_query(text) for text in texts]
+        embeddings = {}
+        for key in keys:
+            cached = self.embedding_cache.get(self.embedding_model_id, "text", key)
+            CACHE_LOOKUPS.inc(cache="text_embedding", result="miss" if cached is None else "hit")
+            if cached is not None:
+                embeddings[key] = cached
+
+        # Similar lengths share a batch, which keeps padding small
+        missing = sorted({key for key in keys if key not in embeddings}, key=len)
+        for i in range(0, len(missing), self.encode_batch_size):
+            batch_keys = missing[i:i + self.encode_batch_size]
+            with timed_stage("text_preprocess", self.embedding_model_id), self._tokenizer_lock:
+                inputs = self.processor(text=batch_keys, return_tensors="np", padding=True)
+            with timed_stage("text_forward", self.embedding_model_id):
+                batch_embeddings = self.encoder.encode_text(inputs['input_ids'], inputs['attention_mask'])
+
+            # Normalize
+            batch_embeddings = batch_embeddings / np.linalg.norm(batch_embeddings, axis=1, keepdims=True)
+            for key, embedding in zip(batch_keys, batch_embeddings):
+                self.embedding_cache.set(self.embedding_model_id, "text", key, embedding)
+                embeddings[key] = embedding
+
+        return np.stack([embeddings[key] for key in keys]).astype(np.float32)
+
     def encode_text(self, text: str) -> List[float]:
         """Encode text query into CLIP embedding"""
-        inputs = self.processor(text=[text], return_tensors="pt", padding=True)
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        
-        with torch.no_grad():
-            text_features = self.model.get_text_features(**inputs)
-            
-        # Move to CPU and normalize
-        embedding = text_features[0].cpu().numpy()
-        normalized_embedding = embedding / np.linalg.norm(embedding)
-        return normalized_embedding.tolist()
+        return self.encode_texts([text])[0].tolist()
+
+    def encode_images(self, images: List[bytes]) -> List[Optional[np.ndarray]]:
+        """Encode many images; cache misses go through the vision tower in batches
+
+        Images that can't be decoded come back as None.
+        """
+        embeddings: List[Optional[np.ndarray]] = [None] * len(images)
+        # byte hash -> (dhash, decoded image, positions in the input)
+        pending: Dict[str, Tuple[Optional[str], Image.Image, List[int]]] = {}
+
+        for i, image_bytes in enumerate(images):
+            byte_key = content_hash(image_bytes)
+            if byte_key in pending:
+                pending[byte_key][2].append(i)
+                continue
+            cached = self.embedding_cache.get(self.embedding_model_id, "image", byte_key)
+            CACHE_LOOKUPS.inc(cache="image_embedding", result="miss" if cached is None else "hit")
+            if cached is not None:
+                embeddings[i] = cached
+                continue
+
+            try:
+                # Convert bytes to PIL Image
+                with timed_stage("image_decode", self.embedding_model_id):
+                    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            except Exception as e:
+                print(f"Error encoding image: {e}")
+                continue
+
+            pixel_key = None
+            if self.perceptual_hash:
+                pixel_key = dhash(image)
+                cached = self.embedding_cache.get(self.embedding_model_id, "image-dhash", pixel_key)
+                if cached is not None:
+                    self.embedding_cache.set(self.embedding_model_id, "image", byte_key, cached)
+                    embeddings[i] = cached
+                    continue
+
+            pending[byte_key] = (pixel_key, image, [i])
+
+        items = list(pending.items())
+        for start in range(0, len(items), self.encode_batch_size):
+            batch = items[start:start + self.encode_batch_size]
+
+            # Process images
+            with timed_stage("image_preprocess", self.embedding_model_id):
+                inputs = self.processor(images=[image for _, (_, image, _) in batch], return_tensors="np")
+
+            # Get image features and normalize
+            with timed_stage("image_forward", self.embedding_model_id):
+                batch_embeddings = self.encoder.encode_pixels(inputs['pixel_values'])
+            batch_embeddings = batch_embeddings / np.linalg.norm(batch_embeddings, axis=1, keepdims=True)
+            for (byte_key, (pixel_key, _, positions)), embedding in zip(batch, batch_embeddings):
+                self.embedding_cache.set(self.embedding_model_id, "image", byte_key, embedding)
+                if pixel_key is not None:
+                    self.embedding_cache.set(self.embedding_model_id, "image-dhash", pixel_key, embedding)
+                for i in positions:
+                    embeddings[i] = embedding
+
+        return embeddings
 
     def encode_image(self, image_bytes: bytes) -> Optional[List[float]]:
         """Encode image into CLIP embedding"""
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            
-            # Process image
-            inputs = self.processor(images=image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            # Get image features
-            with torch.no_grad():
-                image_features = self.model.get_image_features(**inputs)
-                
-            # Move to CPU and normalize
-            embedding = image_features[0].cpu().numpy()
-            normalized_embedding = embedding / np.linalg.norm(embedding)
-            return normalized_embedding.tolist()
+            embedding = self.encode_images([image_bytes])[0]
+            return embedding.tolist() if embedding is not None else None
         except Exception as e:
             print(f"Error encoding image: {e}")
             return None
 
-    def search(self, query: str, top_k: int = 5, threshold: float = 0.0) -> List[dict]:
+    def query_embeddings(self, query_embeddings: List[Any], top_k: int) -> Dict[str, Any]:
+        """Run one vector query for any number of normalized embeddings"""
+        backend = self.chroma_backend
+        if self.snapshot_backend is not None and self._snapshot_is_fresh():
+            backend = self.snapshot_backend
+        with timed_stage("vector_query", self.embedding_model_id):
+            return backend.query(np.asarray(query_embeddings, dtype=np.float32), top_k)
+
+    def stored_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Embeddings already in the index for the given ids, from the same backend queries use"""
+        backend = self.chroma_backend
+        if self.snapshot_backend is not None and self._snapshot_is_fresh():
+            backend = self.snapshot_backend
+        with timed_stage("vector_fetch", self.embedding_model_id):
+            return backend.get_embeddings(ids)
+
+    def _snapshot_is_fresh(self) -> bool:
+        """Compare the snapshot against the collection, at most once per staleness_check_interval"""
+        if self.collection is None:
+            # Read-only mode: the snapshot is all there is
+            return True
+        now = time.monotonic()
+        if now - self._last_staleness_check >= self.staleness_check_interval:
+            self._last_staleness_check = now
+            stale = self.snapshot_backend.is_stale(chroma_fingerprint(self.chroma_path, self.collection))
+            if stale and not self._snapshot_stale:
+                print("Snapshot is out of date with the collection, falling back to ChromaDB queries")
+            self._snapshot_stale = stale
+        return not self._snapshot_stale
+
+    def search(self, query: str, top_k: int = 5, threshold: float = 0.0, enrich: bool = True) -> List[dict]:
         """
         Search for anime characters based on text description
         Args:
             query: Text description to search for
             top_k: Number of results to return
             threshold: Minimum similarity score threshold
+            enrich: Whether to attach Jikan data (otherwise jikan_data is None)
         Returns:
             List of dicts containing character info and scores
         """
@@ -79,166 +241,122 @@ class AnimeImageSearch:
                 return []
             
             # Query ChromaDB
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k,
-                include=["documents", "distances", "metadatas"]
-            )
-            
-            # Format results
-            character_results = []
-            
-            # Process each result synchronously
-            import requests
-            import time
-            
-            for doc, dist, metadata in zip(
-                results['documents'][0], 
-                results['distances'][0],
-                results['metadatas'][0] if results.get('metadatas') else [{}] * len(results['documents'][0])
-            ):
-                # Convert distance to similarity score
-                similarity = 1 - (dist / 2)  # Assuming normalized distance
-                
-                if similarity >= threshold:
-                    # Get Jikan data synchronously
-                    search_name = doc.replace(',', '').strip()
-                    try:
-                        # Rate limiting
-                        time.sleep(0.25)  # Wait between API calls
-                        response = requests.get(f"https://api.jikan.moe/v4/characters?q={search_name}&limit=1")
-                        jikan_data = None
-                        if response.status_code == 200:
-                            data = response.json()
-                            if data.get('data') and len(data['data']) > 0:
-                                jikan_data = {
-                                    'mal_id': data['data'][0]['mal_id'],
-                                    'url': data['data'][0]['url'],
-                                    'image_url': data['data'][0]['images']['jpg']['image_url'],
-                                    'name': data['data'][0]['name']
-                                }
-                    except Exception as e:
-                        print(f"Error fetching Jikan data for {search_name}: {e}")
-                        jikan_data = None
-                    
-                    character_results.append({
-                        'character_name': doc,
-                        'image_id': doc.replace(' ', '_'),
-                        'similarity_score': similarity,
-                        'metadata': metadata,
-                        'jikan_data': jikan_data
-                    })
-                    
-            return character_results
+            results = self.query_embeddings([query_embedding], top_k)
             
+            return self._format_results(results, threshold, enrich)
+
         except Exception as e:
             print(f"Error performing search: {e}")
             return []
 
-    async def get_character_info(self, character_name: str) -> Dict[Any, Any]:
+    def _format_results(self, results: Dict[str, Any], threshold: float, enrich: bool = True) -> List[dict]:
+        """Turn a single-query ChromaDB result into result dicts, enriching all hits concurrently"""
+        character_results = self._hits(results, 0, threshold)
+        if enrich:
+            self.enrich_results(character_results)
+        return character_results
+
+    def _hits(self, results: Dict[str, Any], index: int, threshold: float) -> List[dict]:
+        """Result dicts (without Jikan data) for the index-th query of a ChromaDB result"""
+        character_results = []
+
+        for doc, dist, metadata in zip(
+            results['documents'][index],
+            results['distances'][index],
+            results['metadatas'][index] if results.get('metadatas') else [{}] * len(results['documents'][index])
+        ):
+            # Convert distance to similarity score
+            similarity = distance_to_similarity(dist, self.space)
+
+            if similarity >= threshold:
+                character_results.append({
+                    'character_name': doc,
+                    'image_id': doc.replace(' ', '_'),
+                    'similarity_score': similarity,
+                    'metadata': metadata,
+                    'jikan_data': None
+                })
+
+        return character_results
+
+    def search_batch(self,
+                     texts: Optional[List[str]] = None,
+                     images: Optional[List[bytes]] = None,
+                     top_k: int = 5,
+                     threshold: float = 0.0,
+                     enrich: bool = True) -> List[List[dict]]:
+        """
+        Search many text and/or image queries at once
+        Args:
+            texts: Text descriptions to search for
+            images: Raw image bytes to search with
+            top_k: Number of results per query
+            threshold: Minimum similarity score threshold
+            enrich: Whether to attach Jikan data
+        Returns:
+            One list of result dicts per query, texts first and then images, in input order.
+            Images that can't be decoded get an empty list.
+        """
+        texts = list(texts or [])
+        images = list(images or [])
+
+        embeddings: List[Optional[np.ndarray]] = list(self.encode_texts(texts)) if texts else []
+        embeddings.extend(self.encode_images(images))
+
+        all_results: List[List[dict]] = [[] for _ in embeddings]
+        valid = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        if valid:
+            results = self.query_embeddings([embeddings[i] for i in valid], top_k)
+            for row, i in enumerate(valid):
+                all_results[i] = self._hits(results, row, threshold)
+
+        if enrich:
+            # Characters that show up for several queries are looked up once
+            self.enrich_results([hit for hits in all_results for hit in hits])
+        return all_results
+
+    def enrich_results(self, character_results: List[dict]) -> List[dict]:
+        """Fill in jikan_data for every result with one concurrent, rate-limited batch of lookups"""
+        with timed_stage("enrichment", self.embedding_model_id):
+            jikan_data = self.jikan.fetch_many(r['character_name'] for r in character_results)
+        for result in character_results:
+            result['jikan_data'] = jikan_data[result['character_name']]
+        return character_results
+
+    def fetch_jikan_data(self, character_name: str) -> Optional[dict]:
+        """Look up a character on Jikan, going to the network only on a cache miss"""
+        return self.jikan.fetch(character_name)
+
+    async def get_character_info(self, character_name: str) -> Optional[dict]:
         """Fetch character information from Jikan API"""
-        # Clean up the name for search
-        search_name = character_name.replace(',', '').strip()
-        
-        async with aiohttp.ClientSession() as session:
-            # Use Jikan v4 API
-            url = f"https://api.jikan.moe/v4/characters?q={search_name}&limit=1"
-            try:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        import json
-                        with open("data.json" , "w") as f:
-                            json.dump(data , f , indent=4)
-                        if data['data']:
-                            return {
-                                
-                                'mal_id': data['data'][0]['mal_id'],
-                                'url': data['data'][0]['url'],
-                                'image_url': data['data'][0]['images']['jpg']['image_url'],
-                                'name': data['data'][0]['name']
-                            }
-            except Exception as e:
-                print(f"Error fetching data for {character_name}: {e}")
-            return None
+        return await self.jikan.fetch_async(character_name)
 
     async def search_with_jikan(self, query: str, top_k: int = 5):
         """Search characters and enrich results with Jikan data"""
-        base_results = self.search(query, top_k)
-        enriched_results = []
-
-        # Need to rate limit Jikan API calls (4 requests/second)
-        for char_name, image_id, score in base_results:
-            # Wait 0.25 seconds between requests
-            await asyncio.sleep(0.25)
-            jikan_data = await self.get_character_info(char_name)
-            
-            enriched_results.append({
-                'character_name': char_name,
-                'image_id': image_id,
-                'similarity_score': score,
-                'jikan_data': jikan_data
-            })
-            
-        return enriched_results
+        base_results = self.search(query, top_k, enrich=False)
+
+        # All lookups go out together; the shared limiter keeps them within Jikan's quota
+        jikan_data = await self.jikan.fetch_many_async(r['character_name'] for r in base_results)
+        for result in base_results:
+            result['jikan_data'] = jikan_data[result['character_name']]
+
+        return base_results
 
     def search_by_image(self, 
                        image_bytes: bytes, 
                        top_k: int = 5,
-                       threshold: float = 0.0) -> List[dict]:
+                       threshold: float = 0.0,
+                       enrich: bool = True) -> List[dict]:
         """Image-based search for anime characters"""
         try:
             query_embedding = self.encode_image(image_bytes)
             if query_embedding is None:
                 return []
             
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k,
-                include=["documents", "distances", "metadatas"]
-            )
-            
-            character_results = []
-            import requests
-            import time
-            
-            for doc, dist, metadata in zip(
-                results['documents'][0], 
-                results['distances'][0],
-                results['metadatas'][0] if results.get('metadatas') else [{}] * len(results['documents'][0])
-            ):
-                similarity = 1 - (dist / 2)
-                if similarity >= threshold:
-                    # Get Jikan data synchronously
-                    search_name = doc.replace(',', '').strip()
-                    try:
-                        # Rate limiting
-                        time.sleep(0.25)  # Wait between API calls
-                        response = requests.get(f"https://api.jikan.moe/v4/characters?q={search_name}&limit=1")
-                        jikan_data = None
-                        if response.status_code == 200:
-                            data = response.json()
-                            if data.get('data') and len(data['data']) > 0:
-                                jikan_data = {
-                                    'mal_id': data['data'][0]['mal_id'],
-                                    'url': data['data'][0]['url'],
-                                    'image_url': data['data'][0]['images']['jpg']['image_url'],
-                                    'name': data['data'][0]['name']
-                                }
-                    except Exception as e:
-                        print(f"Error fetching Jikan data for {search_name}: {e}")
-                        jikan_data = None
-                        
-                    character_results.append({
-                        'character_name': doc,
-                        'image_id': doc.replace(' ', '_'),
-                        'similarity_score': similarity,
-                        'metadata': metadata,
-                        'jikan_data': jikan_data
-                    })
-                    
-            return character_results
+            results = self.query_embeddings([query_embedding], top_k)
             
+            return self._format_results(results, threshold, enrich)
+
         except Exception as e:
             print(f"Error performing image search: {e}")
             return []
@@ -2,6 +2,7 @@ import streamlit as st
 import requests
 from PIL import Image
 import io
+import json
 
 # Configure page with custom theme and layout
 st.set_page_config(
@@ -105,80 +106,98 @@ st.markdown("""
 FLASK_API = "http://localhost:5000"
 TEXT_SEARCH_URL = f"{FLASK_API}/search/text"
 IMAGE_SEARCH_URL = f"{FLASK_API}/search/image"
+TEXT_STREAM_URL = f"{FLASK_API}/search/text/stream"
+IMAGE_STREAM_URL = f"{FLASK_API}/search/image/stream"
 
-def display_results(results):
-    """Display search results in a grid with improved styling"""
+def render_card(result):
+    """One result card; re-rendered in place when its enrichment arrives"""
+    with st.container():
+        # Card container
+        st.markdown('<div class="result-card">', unsafe_allow_html=True)
+
+        # Character name header
+        display_name = result['jikan_data']['name'] if result.get('jikan_data') else result['name']
+        st.markdown(f'<div class="character-name">{display_name}</div>', unsafe_allow_html=True)
+
+        # Image display
+        image_url = f"{FLASK_API}/thumbnails/{result['id']}"
+        try:
+            st.image(
+                image_url,
+                use_container_width=True,
+                output_format="JPEG",
+                clamp=True  # Ensures consistent color range
+            )
+
+            # Similarity score with color coding
+            score = result['score']
+            color = '#28a745' if score > 0.7 else '#ffc107' if score > 0.5 else '#dc3545'
+            st.markdown(f"""
+                <div class="similarity-score" style="background-color: {color}; color: white;">
+                    Similarity: {score:.1%}
+                </div>
+            """, unsafe_allow_html=True)
+
+            # MAL link if available
+            if result.get('jikan_data'):
+                mal_url = result['jikan_data']['url']
+                st.markdown(f"""
+                    <div style="text-align: center;">
+                        <a href="{mal_url}" target="_blank" 
+                           style="text-decoration: none; color: #FF4B4B;">
+                            View on MAL 🔗
+                        </a>
+                    </div>
+                """, unsafe_allow_html=True)
+
+                # Expandable details section
+                with st.expander("Details 📝"):
+                    st.markdown(f"""
+                        <div class="details-section">
+                            <p><strong>MAL ID:</strong> {result['jikan_data']['mal_id']}</p>
+                            <p><strong>Official Name:</strong> {result['jikan_data']['name']}</p>
+                            <p><strong>Database Name:</strong> {result['name']}</p>
+                        </div>
+                    """, unsafe_allow_html=True)
+
+        except Exception as e:
+            st.error(f"Error loading image: {str(e)}")
+
+        # Close card container
+        st.markdown('</div>', unsafe_allow_html=True)
+
+def display_results(response):
+    """Render cards as soon as the hits arrive, then fill in MAL details as each lookup returns"""
+    messages = (json.loads(line) for line in response.iter_lines() if line)
+    first = next(messages, {'type': 'error', 'error': 'Empty response'})
+    if first['type'] == 'error':
+        st.error(f"Error: {first['error']}")
+        return
+    results = first['results']
     if not results:
         st.warning("No results found 😕")
         return
-    
-    # Calculate number of rows needed for 3 columns
-    num_results = len(results)
-    num_rows = (num_results + 2) // 3  # Round up division
-    
-    for row in range(num_rows):
-        # Create a row with 3 columns
+
+    # 3-column grid with a slot per card that can be redrawn
+    placeholders = []
+    for row in range((len(results) + 2) // 3):
         cols = st.columns(3)
-        
         for col_idx in range(3):
-            result_idx = row * 3 + col_idx
-            if result_idx < num_results:
-                result = results[result_idx]
+            if row * 3 + col_idx < len(results):
                 with cols[col_idx]:
-                    with st.container():
-                        # Card container
-                        st.markdown('<div class="result-card">', unsafe_allow_html=True)
-                        
-                        # Character name header
-                        display_name = result['jikan_data']['name'] if result.get('jikan_data') else result['name']
-                        st.markdown(f'<div class="character-name">{display_name}</div>', unsafe_allow_html=True)
-                        
-                        # Image display
-                        image_url = f"{FLASK_API}/thumbnails/{result['id']}"
-                        try:
-                            st.image(
-                                image_url,
-                                use_container_width=True,
-                                output_format="JPEG",
-                                clamp=True  # Ensures consistent color range
-                            )
-                            
-                            # Similarity score with color coding
-                            score = result['score']
-                            color = '#28a745' if score > 0.7 else '#ffc107' if score > 0.5 else '#dc3545'
-                            st.markdown(f"""
-                                <div class="similarity-score" style="background-color: {color}; color: white;">
-                                    Similarity: {score:.1%}
-                                </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # MAL link if available
-                            if result.get('jikan_data'):
-                                mal_url = result['jikan_data']['url']
-                                st.markdown(f"""
-                                    <div style="text-align: center;">
-                                        <a href="{mal_url}" target="_blank" 
-                                           style="text-decoration: none; color: #FF4B4B;">
-                                            View on MAL 🔗
-                                        </a>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                                
-                                # Expandable details section
-                                with st.expander("Details 📝"):
-                                    st.markdown(f"""
-                                        <div class="details-section">
-                                            <p><strong>MAL ID:</strong> {result['jikan_data']['mal_id']}</p>
-                                            <p><strong>Official Name:</strong> {result['jikan_data']['name']}</p>
-                                            <p><strong>Database Name:</strong> {result['name']}</p>
-                                        </div>
-                                    """, unsafe_allow_html=True)
-                                    
-                        except Exception as e:
-                            st.error(f"Error loading image: {str(e)}")
-                        
-                        # Close card container
-                        st.markdown('</div>', unsafe_allow_html=True)
+                    placeholders.append(st.empty())
+    for placeholder, result in zip(placeholders, results):
+        with placeholder.container():
+            render_card(result)
+
+    for message in messages:
+        if message['type'] == 'enrichment' and message['jikan_data']:
+            result = results[message['index']]
+            result['jikan_data'] = message['jikan_data']
+            with placeholders[message['index']].container():
+                render_card(result)
+        elif message['type'] == 'error':
+            st.error(f"Error: {message['error']}")
 
 def main():
     # Sidebar for app navigation and filters
@@ -220,16 +239,17 @@ def main():
                 with st.spinner("🎯 Searching for matching characters..."):
                     try:
                         response = requests.post(
-                            TEXT_SEARCH_URL,
+                            TEXT_STREAM_URL,
                             json={
                                 "query": query,
                                 "top_k": top_k,
                                 "threshold": threshold
-                            }
+                            },
+                            stream=True
                         )
                         if response.status_code == 200:
                             st.success("✨ Found some matches!")
-                            display_results(response.json()['results'])
+                            display_results(response)
                         else:
                             st.error(f"Error: {response.json().get('error', 'Unknown error')}")
                     except Exception as e:
@@ -252,17 +272,18 @@ def main():
                         try:
                             files = {'file': ('image.jpg', uploaded_file, 'image/jpeg')}
                             response = requests.post(
-                                IMAGE_SEARCH_URL,
+                                IMAGE_STREAM_URL,
                                 files=files,
                                 data={
                                     'top_k': top_k,
                                     'threshold': threshold
-                                }
+                                },
+                                stream=True
                             )
                             
                             if response.status_code == 200:
                                 st.success("✨ Found similar characters!")
-                                display_results(response.json()['results'])
+                                display_results(response)
                             else:
                                 st.error(f"Error: {response.json().get('error', 'Unknown error')}")
                         except Exception as e:
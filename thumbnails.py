@@ -0,0 +1,221 @@
+import concurrent.futures
+import io
+import os
+from typing import BinaryIO, Iterable, List, Optional, Sequence, Tuple, Union
+
+from PIL import Image
+from tqdm import tqdm
+
+from packed_store import PackedStore
+
+# Longest edge in pixels; the first size is the one search results link to
+DEFAULT_SIZES = (200,)
+DEFAULT_FORMATS = ("jpeg",)
+FORMAT_EXTENSIONS = {"jpeg": "jpg", "webp": "webp", "png": "png"}
+FORMAT_OPTIONS = {"jpeg": {"quality": 85, "optimize": True}, "webp": {"quality": 80, "method": 4}, "png": {"optimize": True}}
+
+def _env_list(name: str, default: Tuple, convert=str) -> Tuple:
+    value = os.environ.get(name)
+    return tuple(convert(item) for item in value.replace(",", " ").split()) if value else default
+
+# The variants ingestion generates and the apps serve, shared through the environment, e.g.
+# THUMBNAIL_SIZES="200 400" THUMBNAIL_FORMATS="webp jpeg"; search results link to the first of each
+THUMBNAIL_SIZES: Tuple[int, ...] = _env_list("THUMBNAIL_SIZES", DEFAULT_SIZES, int)
+THUMBNAIL_FORMATS: Tuple[str, ...] = _env_list("THUMBNAIL_FORMATS", DEFAULT_FORMATS)
+for _fmt in THUMBNAIL_FORMATS:
+    if _fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unknown thumbnail format in THUMBNAIL_FORMATS: {_fmt}")
+
+def thumbnail_name(image_id: str, size: int = DEFAULT_SIZES[0], fmt: str = DEFAULT_FORMATS[0]) -> str:
+    """File name of one thumbnail variant; the default size keeps the plain <id>.<ext> name"""
+    suffix = "" if size == DEFAULT_SIZES[0] else f"_{size}"
+    return f"{image_id}{suffix}.{FORMAT_EXTENSIONS[fmt]}"
+
+# Image store opened by each thumbnail worker when sources are PackedStore keys
+_worker_store: Optional[PackedStore] = None
+
+def _init_worker(store_root: Optional[str]):
+    global _worker_store
+    _worker_store = PackedStore(store_root, readonly=True) if store_root else None
+
+def render_thumbnails(source: Union[str, BinaryIO], variants: Sequence[Tuple[int, str]]) -> List[bytes]:
+    """Encoded thumbnails of one image for each (size, format), in the order given"""
+    rendered = {}
+    # Decode once, then shrink from largest to smallest
+    with Image.open(source) as img:
+        largest = max(size for size, _ in variants)
+        img.draft("RGB", (largest, largest))
+        img = img.convert("RGB")
+        for size, fmt in sorted(variants, key=lambda v: -v[0]):
+            img.thumbnail((size, size))
+            buffer = io.BytesIO()
+            img.save(buffer, fmt.upper(), **FORMAT_OPTIONS.get(fmt, {}))
+            rendered[size, fmt] = buffer.getvalue()
+    return [rendered[variant] for variant in variants]
+
+def _write_file(path: str, data: bytes):
+    # Write-then-rename so the server never sends a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def thumbnail_variants(image_id: str) -> List[dict]:
+    """Every configured thumbnail of an image, the one results link to first"""
+    return [{'size': size, 'format': fmt, 'id': thumbnail_name(image_id, size, fmt)}
+            for size in THUMBNAIL_SIZES for fmt in THUMBNAIL_FORMATS]
+
+def parse_thumbnail_name(name: str) -> Optional[Tuple[str, int, str]]:
+    """(image id, size, format) of a configured thumbnail variant's file name, or None"""
+    variants = [(thumbnail_name("", size, fmt), size, fmt) for size in THUMBNAIL_SIZES for fmt in THUMBNAIL_FORMATS]
+    # Longest suffix first, so "x_400.jpg" isn't read as the default size of "x_400"
+    for suffix, size, fmt in sorted(variants, key=lambda v: -len(v[0])):
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return name[:-len(suffix)], size, fmt
+    return None
+
+def _thumbnail_mtime(name: str, thumbnails_dir: Optional[str], thumbnail_store: Optional[PackedStore]) -> Optional[int]:
+    if thumbnail_store is not None:
+        entry = thumbnail_store.stat(name)
+        return entry.mtime_ns if entry is not None else None
+    try:
+        return os.stat(os.path.join(thumbnails_dir, name)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _stale_variants(image_id: str, source_mtime: int, sizes: Sequence[int], formats: Sequence[str],
+                    thumbnails_dir: Optional[str], thumbnail_store: Optional[PackedStore],
+                    force: bool) -> List[Tuple[int, str]]:
+    """Variants that are missing or older than their source image"""
+    variants = []
+    for size in sizes:
+        for fmt in formats:
+            mtime = _thumbnail_mtime(thumbnail_name(image_id, size, fmt), thumbnails_dir, thumbnail_store)
+            if force or mtime is None or mtime < source_mtime:
+                variants.append((size, fmt))
+    return variants
+
+def generate_thumbnail(image_path: str,
+                       thumbnails_dir: str,
+                       sizes: Sequence[int] = DEFAULT_SIZES,
+                       formats: Sequence[str] = DEFAULT_FORMATS,
+                       force: bool = False) -> int:
+    """Write every size/format variant of one image that is missing or older than it; returns how many"""
+    image_id = os.path.splitext(os.path.basename(image_path))[0]
+    variants = _stale_variants(image_id, os.stat(image_path).st_mtime_ns, sizes, formats, thumbnails_dir, None, force)
+    if not variants:
+        return 0
+    for (size, fmt), data in zip(variants, render_thumbnails(image_path, variants)):
+        _write_file(os.path.join(thumbnails_dir, thumbnail_name(image_id, size, fmt)), data)
+    return len(variants)
+
+def _render(task: Tuple[str, List[Tuple[int, str]]]) -> List[bytes]:
+    source, variants = task
+    try:
+        if _worker_store is not None:
+            return render_thumbnails(io.BytesIO(_worker_store.get(source)), variants)
+        return render_thumbnails(source, variants)
+    except Exception as e:
+        print(f"Error creating thumbnails for {source}: {str(e)}")
+        return []
+
+def generate_thumbnails(sources: List[str],
+                        thumbnails_dir: Optional[str],
+                        sizes: Sequence[int] = DEFAULT_SIZES,
+                        formats: Sequence[str] = DEFAULT_FORMATS,
+                        num_workers: Optional[int] = None,
+                        force: bool = False,
+                        image_store: Optional[PackedStore] = None,
+                        thumbnail_store: Optional[PackedStore] = None) -> int:
+    """Create thumbnails for many images in a process pool; returns the number written
+
+    sources are image paths, or keys of image_store. Workers only decode and encode;
+    the results are written here, to thumbnails_dir or to thumbnail_store if one is given.
+    """
+    for fmt in formats:
+        if fmt not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Unknown thumbnail format: {fmt}")
+    if thumbnail_store is None:
+        os.makedirs(thumbnails_dir, exist_ok=True)
+
+    tasks = []
+    for source in sources:
+        image_id = os.path.splitext(os.path.basename(source))[0]
+        source_mtime = image_store.stat(source).mtime_ns if image_store is not None else os.stat(source).st_mtime_ns
+        variants = _stale_variants(image_id, source_mtime, sizes, formats, thumbnails_dir, thumbnail_store, force)
+        if variants:
+            tasks.append((source, variants))
+    if not tasks:
+        return 0
+
+    store_root = image_store.root if image_store is not None else None
+    executor = None
+    if num_workers == 0:
+        # Inline, like anime_clip_processor.ingest with num_workers=0
+        _init_worker(store_root)
+        results = map(_render, tasks)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers, initializer=_init_worker, initargs=(store_root,)
+        )
+        results = executor.map(_render, tasks, chunksize=16)
+
+    written = 0
+    try:
+        for (source, variants), blobs in tqdm(zip(tasks, results), total=len(tasks), desc="Creating thumbnails"):
+            image_id = os.path.splitext(os.path.basename(source))[0]
+            for (size, fmt), data in zip(variants, blobs):
+                name = thumbnail_name(image_id, size, fmt)
+                if thumbnail_store is not None:
+                    thumbnail_store.put(name, data)
+                else:
+                    _write_file(os.path.join(thumbnails_dir, name), data)
+                written += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return written
+
+def remove_thumbnails(image_ids: Iterable[str],
+                      thumbnails_dir: Optional[str],
+                      sizes: Sequence[int] = DEFAULT_SIZES,
+                      formats: Sequence[str] = DEFAULT_FORMATS,
+                      thumbnail_store: Optional[PackedStore] = None):
+    """Delete the thumbnails of images that left the collection"""
+    for image_id in image_ids:
+        for size in sizes:
+            for fmt in formats:
+                name = thumbnail_name(image_id, size, fmt)
+                if thumbnail_store is not None:
+                    thumbnail_store.delete(name)
+                    continue
+                try:
+                    os.remove(os.path.join(thumbnails_dir, name))
+                except FileNotFoundError:
+                    pass
+
+if __name__ == "__main__":
+    import argparse
+
+    from ingest_manifest import IMAGE_EXTENSIONS, scan_images
+
+    parser = argparse.ArgumentParser(description="Create thumbnails for every character image")
+    parser.add_argument("--images", default="./images")
+    parser.add_argument("--thumbnails", default="./thumbnails")
+    parser.add_argument("--image-store", default=None, help="Read images from a PackedStore instead of --images")
+    parser.add_argument("--thumbnail-store", default=None, help="Write thumbnails to a PackedStore instead of --thumbnails")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(THUMBNAIL_SIZES))
+    parser.add_argument("--formats", nargs="+", choices=sorted(FORMAT_EXTENSIONS), default=list(THUMBNAIL_FORMATS))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="Recreate thumbnails that are already up to date")
+    args = parser.parse_args()
+
+    image_store = PackedStore(args.image_store, readonly=True) if args.image_store else None
+    thumbnail_store = PackedStore(args.thumbnail_store) if args.thumbnail_store else None
+    if image_store is not None:
+        sources = [key for key in image_store.keys() if key.lower().endswith(IMAGE_EXTENSIONS)]
+    else:
+        sources = [path for _, path, _, _ in scan_images(args.images)]
+    written = generate_thumbnails(sources, args.thumbnails, args.sizes, args.formats, args.workers, args.force,
+                                  image_store=image_store, thumbnail_store=thumbnail_store)
+    print(f"Wrote {written} thumbnails to {args.thumbnail_store or args.thumbnails}")
@@ -0,0 +1,370 @@
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from index_config import collection_space, similarity_to_distance
+from ingest_manifest import file_sha256
+
+# 2 added per-file checksums and the collection's space and metadata to manifest.json
+SNAPSHOT_FORMAT_VERSION = 2
+SUPPORTED_FORMAT_VERSIONS = (1, 2)
+
+# Everything a snapshot may contain besides manifest.json
+SNAPSHOT_FILES = ("embeddings.f32.npy", "ids.jsonl", "documents.jsonl", "metadatas.jsonl",
+                  "embeddings.f16.npy", "embeddings.i8.npy", "scales.f32.npy")
+
+# Compact copies of the embedding matrix that NumpyBackend can scan instead of float32
+QUANTIZED_DTYPES = ("float16", "int8")
+
+def chroma_fingerprint(chroma_path: str, collection) -> Dict[str, Any]:
+    """Cheap signature of a collection's state: entry count plus the newest write to Chroma's SQLite files"""
+    mtimes = [
+        os.stat(path).st_mtime_ns
+        for path in (os.path.join(chroma_path, "chroma.sqlite3"), os.path.join(chroma_path, "chroma.sqlite3-wal"))
+        if os.path.exists(path)
+    ]
+    return {'count': collection.count(), 'sqlite_mtime_ns': max(mtimes) if mtimes else 0}
+
+def _write_jsonl(path: str, rows: List[Any], mode: str):
+    with open(path, mode, encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+def _read_jsonl(path: str) -> List[Any]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def write_manifest(snapshot_dir: str, manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Record the size and sha256 of every snapshot file and write manifest.json last, atomically
+
+    A snapshot directory is therefore complete once its manifest exists.
+    """
+    manifest = dict(manifest, format_version=SNAPSHOT_FORMAT_VERSION)
+    manifest['files'] = {
+        name: {'size': os.path.getsize(path), 'sha256': file_sha256(path)}
+        for name, path in ((name, os.path.join(snapshot_dir, name)) for name in SNAPSHOT_FILES)
+        if os.path.exists(path)
+    }
+    tmp_path = os.path.join(snapshot_dir, "manifest.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, os.path.join(snapshot_dir, "manifest.json"))
+    return manifest
+
+def verify_snapshot(snapshot_dir: str, checksums: bool = True) -> Dict[str, Any]:
+    """Load a snapshot's manifest and check its files against it; raises ValueError on any mismatch
+
+    Sizes are always compared; checksums=False skips hashing, which reads every byte.
+    """
+    with open(os.path.join(snapshot_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') not in SUPPORTED_FORMAT_VERSIONS:
+        raise ValueError(f"Unsupported snapshot format: {manifest.get('format_version')}")
+
+    # Format 1 snapshots carry no checksums
+    for name, expected in manifest.get('files', {}).items():
+        path = os.path.join(snapshot_dir, name)
+        if not os.path.exists(path):
+            raise ValueError(f"{snapshot_dir}: {name} is missing")
+        if os.path.getsize(path) != expected['size']:
+            raise ValueError(f"{snapshot_dir}: {name} is {os.path.getsize(path)} bytes, expected {expected['size']}")
+        if checksums and file_sha256(path) != expected['sha256']:
+            raise ValueError(f"{snapshot_dir}: {name} does not match its checksum")
+    return manifest
+
+def export_snapshot(collection, snapshot_dir: str, chroma_path: Optional[str] = None, page_size: int = 10000) -> Dict[str, Any]:
+    """Copy a collection's embeddings, ids, documents and metadatas into a memory-mappable snapshot
+
+    Embeddings are paged out of Chroma straight into a float32 .npy file, L2-normalized,
+    so the full collection never sits in memory as Python lists.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    fingerprint = chroma_fingerprint(chroma_path, collection) if chroma_path else {'count': collection.count()}
+    count = fingerprint['count']
+
+    embeddings = None
+    written = 0
+    for offset in range(0, count, page_size):
+        page = collection.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+        vectors = np.asarray(page['embeddings'], dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.lib.format.open_memmap(
+                os.path.join(snapshot_dir, "embeddings.f32.npy"), mode="w+", dtype=np.float32,
+                shape=(count, vectors.shape[1])
+            )
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        embeddings[written:written + len(vectors)] = vectors / np.maximum(norms, 1e-12)
+
+        mode = "w" if offset == 0 else "a"
+        _write_jsonl(os.path.join(snapshot_dir, "ids.jsonl"), page['ids'], mode)
+        _write_jsonl(os.path.join(snapshot_dir, "documents.jsonl"), page['documents'], mode)
+        _write_jsonl(os.path.join(snapshot_dir, "metadatas.jsonl"), page['metadatas'] or [None] * len(page['ids']), mode)
+        written += len(vectors)
+
+    if embeddings is None:
+        raise ValueError("Cannot snapshot an empty collection")
+    embeddings.flush()
+
+    return write_manifest(snapshot_dir, {
+        'collection': collection.name,
+        'collection_metadata': collection.metadata,
+        'space': collection_space(collection),
+        'count': written,
+        'dim': int(embeddings.shape[1]),
+        'created_at': time.time(),
+        'source': fingerprint,
+    })
+
+def write_quantized(snapshot_dir: str, dtype: str, block_size: int = 65536):
+    """Add a float16 or per-vector scaled int8 copy of a snapshot's embeddings
+
+    int8 rows store round(v / scale) with scale = max|v| / 127, kept in scales.f32.npy.
+    """
+    if dtype not in QUANTIZED_DTYPES:
+        raise ValueError(f"Unknown quantized dtype: {dtype}")
+    embeddings = np.load(os.path.join(snapshot_dir, "embeddings.f32.npy"), mmap_mode="r")
+
+    if dtype == "float16":
+        out = np.lib.format.open_memmap(
+            os.path.join(snapshot_dir, "embeddings.f16.npy"), mode="w+", dtype=np.float16, shape=embeddings.shape
+        )
+        for start in range(0, len(embeddings), block_size):
+            out[start:start + block_size] = embeddings[start:start + block_size]
+        out.flush()
+    else:
+        _write_int8(embeddings, snapshot_dir, block_size)
+
+    with open(os.path.join(snapshot_dir, "manifest.json")) as f:
+        write_manifest(snapshot_dir, json.load(f))
+
+def _write_int8(embeddings: np.ndarray, snapshot_dir: str, block_size: int):
+    out = np.lib.format.open_memmap(
+        os.path.join(snapshot_dir, "embeddings.i8.npy"), mode="w+", dtype=np.int8, shape=embeddings.shape
+    )
+    scales = np.lib.format.open_memmap(
+        os.path.join(snapshot_dir, "scales.f32.npy"), mode="w+", dtype=np.float32, shape=(len(embeddings),)
+    )
+    for start in range(0, len(embeddings), block_size):
+        block = np.asarray(embeddings[start:start + block_size])
+        block_scales = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127.0
+        out[start:start + len(block)] = np.round(block / block_scales[:, None]).astype(np.int8)
+        scales[start:start + len(block)] = block_scales
+    out.flush()
+    scales.flush()
+
+def recall_at_k(exact, approx, query_embeddings: np.ndarray, k: int) -> float:
+    """Mean fraction of the exact top-k ids that the approximate backend also returns"""
+    exact_ids = exact.query(query_embeddings, k)['ids']
+    approx_ids = approx.query(query_embeddings, k)['ids']
+    overlaps = [len(set(e) & set(a)) / len(e) for e, a in zip(exact_ids, approx_ids) if e]
+    return float(np.mean(overlaps)) if overlaps else 0.0
+
+def sample_queries(embeddings: np.ndarray, num_queries: int, noise: float = 0.05, seed: int = 0) -> np.ndarray:
+    """Held-out style queries: random stored vectors with gaussian noise, re-normalized"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    queries = np.asarray(embeddings[np.sort(rows)], dtype=np.float32)
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+class ChromaBackend:
+    """Vector queries served by ChromaDB's own index"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def query(self, query_embeddings: np.ndarray, top_k: int) -> Dict[str, Any]:
+        return self.collection.query(
+            query_embeddings=np.asarray(query_embeddings, dtype=np.float32).tolist(),
+            n_results=top_k,
+            include=["documents", "distances", "metadatas"]
+        )
+
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Stored vectors by id; ids the collection doesn't have are left out"""
+        if not ids:
+            return {}
+        found = self.collection.get(ids=list(ids), include=["embeddings"])
+        return {id_: np.asarray(vector, dtype=np.float32) for id_, vector in zip(found['ids'], found['embeddings'])}
+
+class NumpyBackend:
+    """Exact cosine top-k over a memory-mapped snapshot
+
+    Scores are computed block by block with a matmul and argpartition, so peak memory is
+    bounded by queries x block_size no matter how large the snapshot is. Results use
+    Chroma's result layout, with distances expressed in the given Chroma distance space.
+
+    With dtype "float16" or "int8" the coarse scan runs over the compact copy written by
+    write_quantized, and the best rerank_factor * top_k candidates are rescored exactly
+    with the float32 rows, which stay on disk and are only paged in for those candidates.
+    """
+
+    def __init__(self,
+                 snapshot_dir: str,
+                 block_size: int = 65536,
+                 dtype: str = "float32",
+                 rerank_factor: int = 4,
+                 space: Optional[str] = None,
+                 verify: bool = False):
+        # File sizes are always checked; verify also compares checksums, which reads every byte
+        self.manifest = verify_snapshot(snapshot_dir, checksums=verify)
+
+        self.snapshot_dir = snapshot_dir
+        self.block_size = block_size
+        self.dtype = dtype
+        self.rerank_factor = rerank_factor
+        # Defaults to the space of the collection the snapshot was exported from
+        self.space = space or self.manifest.get('space', "l2")
+        self.embeddings = np.load(os.path.join(snapshot_dir, "embeddings.f32.npy"), mmap_mode="r")
+        self.scales = None
+        if dtype == "float32":
+            self.matrix = self.embeddings
+        elif dtype == "float16":
+            self.matrix = np.load(os.path.join(snapshot_dir, "embeddings.f16.npy"), mmap_mode="r")
+        elif dtype == "int8":
+            self.matrix = np.load(os.path.join(snapshot_dir, "embeddings.i8.npy"), mmap_mode="r")
+            self.scales = np.load(os.path.join(snapshot_dir, "scales.f32.npy"), mmap_mode="r")
+        else:
+            raise ValueError(f"Unknown dtype: {dtype}")
+
+        self.ids = _read_jsonl(os.path.join(snapshot_dir, "ids.jsonl"))
+        self.documents = _read_jsonl(os.path.join(snapshot_dir, "documents.jsonl"))
+        self.metadatas = _read_jsonl(os.path.join(snapshot_dir, "metadatas.jsonl"))
+        # id -> row, built on first get_embeddings
+        self._rows: Optional[Dict[str, int]] = None
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Same as ChromaBackend.get_embeddings, read from the float32 rows"""
+        if self._rows is None:
+            self._rows = {id_: row for row, id_ in enumerate(self.ids)}
+        found = [id_ for id_ in ids if id_ in self._rows]
+        if not found:
+            return {}
+        vectors = np.asarray(self.embeddings[[self._rows[id_] for id_ in found]], dtype=np.float32)
+        return dict(zip(found, vectors))
+
+    def is_stale(self, fingerprint: Dict[str, Any]) -> bool:
+        """Whether the collection has changed since the snapshot was taken"""
+        return fingerprint != self.manifest.get('source')
+
+    def _scan(self, queries: np.ndarray, k: int) -> tuple:
+        """Blocked top-k over self.matrix; returns unsorted (indices, scores)"""
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.ids), self.block_size):
+            block = self.matrix[start:start + self.block_size]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores = queries @ block.T
+            if self.scales is not None:
+                scores *= self.scales[start:start + self.block_size]
+            block_k = min(k, scores.shape[1])
+            part = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+
+            # Merge this block's candidates with the running top-k
+            cand_idx = np.concatenate([best_idx, part + start], axis=1)
+            cand_scores = np.concatenate([best_scores, np.take_along_axis(scores, part, axis=1)], axis=1)
+            if cand_idx.shape[1] > k:
+                keep = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+                cand_idx = np.take_along_axis(cand_idx, keep, axis=1)
+                cand_scores = np.take_along_axis(cand_scores, keep, axis=1)
+            best_idx, best_scores = cand_idx, cand_scores
+        return best_idx, best_scores
+
+    def _rerank(self, queries: np.ndarray, candidates: np.ndarray, k: int) -> tuple:
+        """Rescore candidate rows with the full-precision vectors and keep the best k"""
+        rows, inverse = np.unique(candidates, return_inverse=True)
+        exact = np.asarray(self.embeddings[rows], dtype=np.float32)
+        scores = np.einsum('qd,qcd->qc', queries, exact[inverse.reshape(candidates.shape)])
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(candidates, keep, axis=1), np.take_along_axis(scores, keep, axis=1)
+
+    def top_k(self, query_embeddings: np.ndarray, top_k: int) -> tuple:
+        """Return (indices, cosine scores), each (num_queries, k), best first"""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        k = min(top_k, len(self.ids))
+
+        if self.dtype == "float32":
+            indices, scores = self._scan(queries, k)
+        else:
+            candidates, _ = self._scan(queries, min(k * self.rerank_factor, len(self.ids)))
+            indices, scores = self._rerank(queries, candidates, k)
+
+        order = np.argsort(-scores, axis=1)
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+    def query(self, query_embeddings: np.ndarray, top_k: int) -> Dict[str, Any]:
+        indices, scores = self.top_k(query_embeddings, top_k)
+        return {
+            'ids': [[self.ids[i] for i in row] for row in indices],
+            'documents': [[self.documents[i] for i in row] for row in indices],
+            'metadatas': [[self.metadatas[i] for i in row] for row in indices],
+            'distances': similarity_to_distance(scores, self.space).tolist(),
+        }
+
+if __name__ == "__main__":
+    import argparse
+    import chromadb
+
+    parser = argparse.ArgumentParser(description="Build and check NumPy snapshots of a Chroma collection")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export a collection to a snapshot")
+    export_parser.add_argument("--chroma-path", default="./chroma_last")
+    export_parser.add_argument("--collection", default="anime_clip_embeddings")
+    export_parser.add_argument("--out", default="./snapshots/anime_clip_embeddings")
+    export_parser.add_argument("--page-size", type=int, default=10000)
+    export_parser.add_argument("--quantize", nargs="*", choices=QUANTIZED_DTYPES, default=[],
+                               help="Also write compact copies for quantized search")
+
+    import_parser = subparsers.add_parser("import", help="Verify a snapshot and load it into a collection")
+    import_parser.add_argument("snapshot")
+    import_parser.add_argument("--chroma-path", default="./chroma_last")
+    import_parser.add_argument("--collection", default=None, help="Defaults to the exported collection's name")
+    import_parser.add_argument("--batch-size", type=int, default=5000)
+    import_parser.add_argument("--writers", type=int, default=4)
+
+    verify_parser = subparsers.add_parser("verify", help="Check a snapshot's files against its manifest")
+    verify_parser.add_argument("snapshot")
+
+    recall_parser = subparsers.add_parser("recall", help="Measure recall@k of a quantized scan against exact search")
+    recall_parser.add_argument("--snapshot", default="./snapshots/anime_clip_embeddings")
+    recall_parser.add_argument("--dtype", choices=QUANTIZED_DTYPES, default="int8")
+    recall_parser.add_argument("--k", type=int, default=10)
+    recall_parser.add_argument("--rerank-factor", type=int, default=4)
+    recall_parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        chroma_client = chromadb.PersistentClient(path=args.chroma_path)
+        collection = chroma_client.get_collection(args.collection)
+        manifest = export_snapshot(collection, args.out, chroma_path=args.chroma_path, page_size=args.page_size)
+        for dtype in args.quantize:
+            write_quantized(args.out, dtype)
+        print(f"Exported {manifest['count']} embeddings ({manifest['dim']}-d) to {args.out}")
+    elif args.command == "import":
+        from bulk_load import import_snapshot
+
+        chroma_client = chromadb.PersistentClient(path=args.chroma_path)
+        collection, stats = import_snapshot(chroma_client, args.snapshot, args.collection,
+                                            batch_size=args.batch_size, num_writers=args.writers)
+        print(f"Imported {stats['rows']} rows ({stats['failed']} failed) into {collection.name} in "
+              f"{stats['seconds']:.1f}s ({stats['rows_per_second']:.0f} rows/s)")
+    elif args.command == "verify":
+        manifest = verify_snapshot(args.snapshot)
+        print(f"{args.snapshot}: format {manifest['format_version']}, {manifest['count']} embeddings "
+              f"({manifest['dim']}-d), {len(manifest.get('files', {}))} files verified")
+    else:
+        exact = NumpyBackend(args.snapshot)
+        approx = NumpyBackend(args.snapshot, dtype=args.dtype, rerank_factor=args.rerank_factor)
+        queries = sample_queries(exact.embeddings, args.queries)
+        recall = recall_at_k(exact, approx, queries, args.k)
+        print(f"{args.dtype} (rerank x{args.rerank_factor}): recall@{args.k} = {recall:.4f} over {len(queries)} queries")
@@ -1,4 +1,8 @@
 
+import requests
+
+from packed_store import PackedStore
+
 res = []
 
 # Function to handle rate-limited API fetching
@@ -22,48 +26,35 @@ def fetch_characters(anime_id):
         print(f"Error fetching Anime ID {anime_id}: {e}")
         return []
 
-# Function to download images
-def download_image(item):
+# Function to download images; with a PackedStore they are appended to it instead of images/
+def download_image(item, store: PackedStore = None):
     img_url, name = item
     try:
         img_data = requests.get(img_url, timeout=10).content
-        with open(f"images/{name}.jpg", 'wb') as handler:
-            handler.write(img_data)
+        if store is not None:
+            store.put(f"{name}.jpg", img_data)
+        else:
+            with open(f"images/{name}.jpg", 'wb') as handler:
+                handler.write(img_data)
         print(f"Downloaded: {name}")
     except Exception as e:
         print(f"Failed to download {name}: {e}")
-# # Step 1: Fetch all character images (parallelized)
-# anime_ids = range(20000 , 30000)  # Increase range as needed, small for testing
-
-# # Track time to ensure rate limiting
-# start_time = time.time()
-# requests_made = 0
 
-# with ThreadPoolExecutor(max_workers=20) as executor:
-#     futures = []
-#     for anime_id in anime_ids:
-#         # Ensure requests per minute limit
-#         if requests_made >= 45:
-#             elapsed_time = time.time() - start_time
-#             if elapsed_time < 45:  # If it's less than a minute, wait
-#                 time_to_wait = 45 - elapsed_time
-#                 print(f"Rate limit reached. Sleeping for {time_to_wait} seconds...")
-#                 time.sleep(time_to_wait)
-#                 start_time = time.time()  # Reset time
-#                 requests_made = 0  # Reset the request counter
-        
-#         futures.append(executor.submit(fetch_characters, anime_id))
-#         requests_made += 1
-#         time.sleep(1)  # Slow down to 1 request per second
-    
-#     for future in as_completed(futures):
-#         characters = future.result()
-#         res.extend(characters)
+if __name__ == "__main__":
+    import argparse
 
-# print(f"\nTotal characters fetched: {len(res)}\n")
+    from crawler import JIKAN_API_BASE, crawl
 
-# # Step 2: Download all images (parallelized)
-# with ThreadPoolExecutor(max_workers=20) as executor:
-#     executor.map(download_image, res)
+    # Async, rate-limited per host and resumable: rerunning skips finished anime ids and images
+    parser = argparse.ArgumentParser(description="Download character images for a range of anime ids")
+    parser.add_argument("--start", type=int, default=20000)
+    parser.add_argument("--end", type=int, default=30000)
+    parser.add_argument("--images", default="./images")
+    parser.add_argument("--store", default=None, help="Append images to a PackedStore instead of --images")
+    parser.add_argument("--state", default="./crawl_state.sqlite3")
+    parser.add_argument("--api-base", default=JIKAN_API_BASE, help="e.g. a local stand-in server for testing")
+    parser.add_argument("--download-workers", type=int, default=16)
+    args = parser.parse_args()
 
-# print(f"\n🎯 Downloaded {len(res)} images successfully!")
\ No newline at end of file
+    crawl(range(args.start, args.end), images_dir=args.images, state_path=args.state, store=args.store,
+          api_base=args.api_base, download_workers=args.download_workers)